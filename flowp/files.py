@@ -3,8 +3,16 @@ import subprocess
 import shutil
 import glob as orgglob
 import os.path
+import stat
 import threading
 import time
+import sys
+import select
+import struct
+import fnmatch
+import ctypes
+import ctypes.util
+import zlib
 
 
 # Aliases
@@ -134,6 +142,571 @@ def mv(src, dst):
         shutil.move(f, dst)
 
 
+def _files_list(pattern):
+    if isinstance(pattern, str):
+        return glob(pattern)
+
+    l = []
+    for p in pattern:
+        l.extend(glob(p))
+
+    return l
+
+
+def _patterns(pattern):
+    if isinstance(pattern, str):
+        return [pattern]
+    return list(pattern)
+
+
+def _match_name(name, pattern):
+    """Check if single path component matches glob pattern component"""
+    if not orgglob.has_magic(pattern):
+        return name == pattern
+    if name.startswith('.') and not pattern.startswith('.'):
+        return False
+    return fnmatch.fnmatch(name, pattern)
+
+
+def _match(path, pattern):
+    """Check if path matches glob pattern the same way as
+    glob.glob would do it (wildcards do not cross directory
+    separators and hidden files are matched only explicitly).
+    """
+    path_parts = path.split(os.sep)
+    pattern_parts = pattern.split(os.sep)
+    if len(path_parts) != len(pattern_parts):
+        return False
+    for name, pat in zip(path_parts, pattern_parts):
+        if not _match_name(name, pat):
+            return False
+    return True
+
+
+def _pattern_dirs(pattern):
+    """Return list of directory patterns which have to be observed to
+    notice all changes of files matched by given glob pattern. These
+    are the directory of the pattern and all its upper directories
+    containing wildcards (new subdirectories may appear in them).
+    """
+    dirs = []
+    head = os.path.dirname(pattern)
+    while True:
+        dirs.append(head)
+        if not orgglob.has_magic(head):
+            break
+        head = os.path.dirname(head)
+    return dirs
+
+
+#: Files and directories modified in last seconds are checked again,
+#: their modification time could be too coarse to notice next changes
+RACY_INTERVAL = 2
+
+
+def stable_mtime_ns(st):
+    """Return modification time of os.stat() result, -1 if it was
+    modified in last RACY_INTERVAL seconds, so that it's never equal
+    to modification time of later changes.
+    """
+    if time.time() - st.st_mtime < RACY_INTERVAL:
+        return -1
+    return st.st_mtime_ns
+
+
+class _DirSnapshot:
+    """Names of entries in a directory at the moment of its
+    last modification.
+    """
+    __slots__ = ('key', 'stable', 'files', 'dirs', 'matches')
+
+    def __init__(self, key, stable, files, dirs):
+        self.key = key
+        self.stable = stable
+        self.files = files
+        self.dirs = dirs
+        self.matches = {}
+
+    def match(self, pattern, dirs_only=False):
+        """Return names matching glob pattern component, results
+        are cached as long as the snapshot is valid.
+        """
+        cache_key = (pattern, dirs_only)
+        if cache_key not in self.matches:
+            names = self.dirs if dirs_only else self.files
+            self.matches[cache_key] = tuple(
+                n for n in names if _match_name(n, pattern))
+        return self.matches[cache_key]
+
+
+class MtimeDetector:
+    """Files are treated as changed when their modification
+    time changes.
+    """
+    def state(self, path, modified=False):
+        """Return value which differs if file was changed"""
+        return os.path.getmtime(path)
+
+    def forget(self, path):
+        """Drop informations about removed file"""
+        pass
+
+
+class HashDetector:
+    """Files are treated as changed only when their content changes.
+    Content is hashed (crc32) only if file size or modification time
+    changed, or backend reported a write to the file. For each file
+    size, modification time and hash are kept packed in one bytes
+    object.
+    """
+    CHUNK_SIZE = 1024 * 1024
+    SIGNATURE_STRUCT = struct.Struct('qqI')
+
+    def __init__(self):
+        self._signatures = {}
+        self._buffer = bytearray(self.CHUNK_SIZE)
+
+    def state(self, path, modified=False):
+        """Return content hash of the file"""
+        st = os.stat(path)
+        if not stat.S_ISREG(st.st_mode):
+            return st.st_mtime_ns
+        signature = self._signatures.get(path)
+        if signature is not None and not modified:
+            size, mtime_ns, crc = self.SIGNATURE_STRUCT.unpack(signature)
+            if size == st.st_size and mtime_ns == st.st_mtime_ns:
+                return crc
+
+        try:
+            crc = self._hash(path)
+        except PermissionError:
+            return st.st_mtime_ns
+        # Recently modified files are hashed on each check
+        self._signatures[path] = self.SIGNATURE_STRUCT.pack(
+            st.st_size, stable_mtime_ns(st), crc)
+        return crc
+
+    def forget(self, path):
+        """Drop informations about removed file"""
+        self._signatures.pop(path, None)
+
+    def _hash(self, path):
+        crc = 0
+        view = memoryview(self._buffer)
+        with open(path, 'rb', buffering=0) as f:
+            while True:
+                size = f.readinto(self._buffer)
+                if not size:
+                    break
+                crc = zlib.crc32(view[:size], crc)
+        return crc
+
+
+DETECTORS = {
+    'mtime': MtimeDetector,
+    'hash': HashDetector,
+}
+
+
+class PollingBackend:
+    """Watch backend which checks files modification times every
+    `sleep` seconds. New and deleted files are found by comparing
+    directories snapshots, a directory is listed again only if
+    its modification time changed.
+    """
+    def __init__(self, files, sleep, detector=None):
+        self._patterns = _patterns(files)
+        self._sleep = sleep
+        self._detector = detector or MtimeDetector()
+        self._files_states = {}
+        self._snapshots = {}
+        self._wakeup_event = threading.Event()
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+    def register(self):
+        """Register files which should be watched"""
+        files_list, _ = self._scan()
+        for path in files_list:
+            try:
+                self._files_states[path] = self._detector.state(path)
+            except FileNotFoundError:
+                pass
+
+    def events(self, timeout=None):
+        """Wait for changes and return them as list of
+        (path, action) tuples. Files are checked after `sleep`
+        seconds, or `timeout` if shorter.
+        """
+        events = []
+        files_states = self._files_states
+        sleep = self._sleep if timeout is None else min(self._sleep, timeout)
+        if self._wakeup_event.wait(sleep):
+            return events
+
+        # Checking existing files
+        for path in tuple(files_states.keys()):
+            try:
+                state = self._detector.state(path)
+                if state != files_states[path]:
+                    events.append((path, Watch.CHANGE))
+                    files_states[path] = state
+
+            except FileNotFoundError:
+                events.append((path, Watch.DELETE))
+                del files_states[path]
+                self._detector.forget(path)
+
+        # Checking new and deleted files
+        files_list, changed = self._scan()
+        if not changed:
+            return events
+        files_set = set(files_list)
+        for path in tuple(files_states.keys()):
+            if path not in files_set:
+                events.append((path, Watch.DELETE))
+                del files_states[path]
+                self._detector.forget(path)
+        for path in files_list:
+            if path not in files_states:
+                try:
+                    files_states[path] = self._detector.state(path)
+                except FileNotFoundError:
+                    continue
+                events.append((path, Watch.NEW))
+
+        return events
+
+    def wakeup(self):
+        """Stop waiting in :meth:`events`, used when watch is stopped"""
+        self._wakeup_event.set()
+
+    def close(self):
+        pass
+
+    def _scan(self):
+        """Return tuple of files matching patterns and flag telling
+        if any directory changed since the last scan. Files list is
+        built only when something changed.
+        """
+        snapshots = {}
+        leaves = []
+        changed = False
+        for pattern in self._patterns:
+            root = _pattern_dirs(pattern)[-1]
+            rest = pattern[len(root):].lstrip(os.sep)
+            parts = rest.split(os.sep)
+            level = [root]
+            for part in parts[:-1]:
+                subdirs = []
+                for path in level:
+                    snapshot, dir_changed = self._snapshot(path, snapshots)
+                    changed = changed or dir_changed
+                    if snapshot:
+                        subdirs.extend(os.path.join(path, name) for name
+                                       in snapshot.match(part, True))
+                level = subdirs
+            for path in level:
+                snapshot, dir_changed = self._snapshot(path, snapshots)
+                changed = changed or dir_changed
+                if snapshot:
+                    leaves.append((path, snapshot, parts[-1]))
+
+        # Forget directories which are no longer observed
+        if len(snapshots) != len(self._snapshots):
+            changed = True
+        self._snapshots = snapshots
+        if not changed:
+            return [], False
+
+        files_list = []
+        for path, snapshot, part in leaves:
+            files_list.extend(os.path.join(path, name)
+                              for name in snapshot.match(part))
+        return files_list, True
+
+    def _snapshot(self, path, snapshots):
+        if path in snapshots:
+            return snapshots[path], False
+        try:
+            st = os.stat(path or '.')
+        except OSError:
+            return None, path in self._snapshots
+        key = (st.st_ino, st.st_mtime_ns)
+        snapshot = self._snapshots.get(path)
+        dir_changed = False
+        if snapshot is None or snapshot.key != key or not snapshot.stable:
+            try:
+                files, dirs = self._list_dir(path or '.')
+            except OSError:
+                return None, path in self._snapshots
+            # Recently modified directories are listed on each check
+            stable = stable_mtime_ns(st) != -1
+            new_snapshot = _DirSnapshot(key, stable, files, dirs)
+            if snapshot is None or snapshot.files != new_snapshot.files:
+                dir_changed = True
+            snapshot = new_snapshot
+        snapshots[path] = snapshot
+        return snapshot, dir_changed
+
+    def _list_dir(self, path):
+        """Return tuple of entries names and subdirectories names"""
+        files, dirs = [], []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                files.append(entry.name)
+                if entry.is_dir():
+                    dirs.append(entry.name)
+        return frozenset(files), frozenset(dirs)
+
+
+class InotifyBackend:
+    """Watch backend which blocks until linux kernel reports
+    files system events (inotify). Only directories related to the
+    files patterns are observed, so costs doesn't grow with number
+    of watched files.
+    """
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    # Single writes are not observed (IN_MODIFY), file is checked
+    # when writing process closes it
+    WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+                  IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+                  IN_MOVE_SELF | IN_ONLYDIR)
+    EVENT_STRUCT = struct.Struct('iIII')
+    READ_SIZE = 64 * 1024
+
+    _libc = None
+
+    def __init__(self, files, sleep, detector=None):
+        # inotify blocks until events come, sleep value is not used
+        self._patterns = _patterns(files)
+        self._detector = detector or MtimeDetector()
+        self._files_states = {}
+        self._wds = {}
+        self._dirs = {}
+        if not self.is_available():
+            raise OSError('inotify is not available')
+        self._fd = self._libc.inotify_init1(self.IN_NONBLOCK |
+                                            self.IN_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        # wakeup is called by other thread, descriptors can't be
+        # closed while it writes
+        self._fds_lock = threading.Lock()
+
+    @classmethod
+    def is_available(cls):
+        if not sys.platform.startswith('linux'):
+            return False
+        if cls._libc is None:
+            try:
+                libc = ctypes.CDLL(ctypes.util.find_library('c') or
+                                   'libc.so.6', use_errno=True)
+                libc.inotify_init1
+            except (OSError, AttributeError):
+                cls._libc = False
+            else:
+                libc.inotify_add_watch.argtypes = [
+                    ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+                libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+                cls._libc = libc
+        return bool(cls._libc)
+
+    def register(self):
+        """Register files which should be watched"""
+        self._update_watches()
+        for path in _files_list(self._patterns):
+            try:
+                self._files_states[path] = self._detector.state(path)
+            except FileNotFoundError:
+                pass
+
+    def events(self, timeout=None):
+        """Wait for changes and return them as list of
+        (path, action) tuples. Block until kernel reports some
+        events, `timeout` seconds pass or :meth:`wakeup` is called.
+        """
+        readable, _, _ = select.select([self._fd, self._wakeup_r], [], [],
+                                       timeout)
+        if self._fd not in readable:
+            return []
+
+        events = []
+        changed = []
+        resync = False
+        for wd, mask, name in self._read_events():
+            if mask & self.IN_Q_OVERFLOW:
+                resync = True
+                continue
+            if mask & self.IN_IGNORED:
+                self._forget_watch(wd)
+                continue
+            if mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+                resync = True
+                continue
+            if wd not in self._wds:
+                continue
+            path = os.path.join(self._wds[wd], name)
+            if mask & self.IN_ISDIR:
+                # Subdirectories tree changed, files could appear or
+                # disappear without their own events
+                resync = True
+            elif mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+                if path in self._files_states:
+                    del self._files_states[path]
+                    self._detector.forget(path)
+                    events.append((path, Watch.DELETE))
+            elif mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                if path in self._files_states:
+                    changed.append(path)
+                elif self._is_watched(path):
+                    try:
+                        self._files_states[path] = self._detector.state(path)
+                    except FileNotFoundError:
+                        continue
+                    events.append((path, Watch.NEW))
+            elif path in self._files_states:
+                changed.append(path)
+
+        for path in changed:
+            if path not in self._files_states:
+                continue
+            try:
+                state = self._detector.state(path, modified=True)
+            except FileNotFoundError:
+                del self._files_states[path]
+                self._detector.forget(path)
+                events.append((path, Watch.DELETE))
+                continue
+            if state != self._files_states[path]:
+                self._files_states[path] = state
+                events.append((path, Watch.CHANGE))
+
+        if resync:
+            events.extend(self._resync())
+        return events
+
+    def wakeup(self):
+        """Stop waiting in :meth:`events`, used when watch is stopped"""
+        with self._fds_lock:
+            if self._fd >= 0:
+                os.write(self._wakeup_w, b'\0')
+
+    def close(self):
+        with self._fds_lock:
+            if self._fd >= 0:
+                os.close(self._fd)
+                os.close(self._wakeup_r)
+                os.close(self._wakeup_w)
+                self._fd = -1
+
+    def _is_watched(self, path):
+        for pattern in self._patterns:
+            if _match(path, pattern):
+                return True
+        return False
+
+    def _read_events(self):
+        try:
+            data = os.read(self._fd, self.READ_SIZE)
+        except BlockingIOError:
+            return
+        offset = 0
+        size = self.EVENT_STRUCT.size
+        while offset + size <= len(data):
+            wd, mask, cookie, length = \
+                self.EVENT_STRUCT.unpack_from(data, offset)
+            offset += size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            yield wd, mask, os.fsdecode(name)
+
+    def _update_watches(self):
+        """Add watches for all directories related to the files
+        patterns, remove watches of directories which are no
+        longer related.
+        """
+        dirs = set()
+        for pattern in self._patterns:
+            for dir_pattern in _pattern_dirs(pattern):
+                if orgglob.has_magic(dir_pattern):
+                    dirs.update(d for d in glob(dir_pattern)
+                                if os.path.isdir(d))
+                elif os.path.isdir(dir_pattern or '.'):
+                    dirs.add(dir_pattern)
+
+        for path in dirs - set(self._dirs):
+            wd = self._libc.inotify_add_watch(
+                self._fd, os.fsencode(path or '.'), self.WATCH_MASK)
+            if wd < 0:
+                continue
+            if wd in self._wds:
+                # Directory was moved, kernel keeps the same watch
+                del self._dirs[self._wds[wd]]
+            self._dirs[path] = wd
+            self._wds[wd] = path
+
+        for path in set(self._dirs) - dirs:
+            wd = self._dirs.pop(path)
+            del self._wds[wd]
+            self._libc.inotify_rm_watch(self._fd, wd)
+
+    def _forget_watch(self, wd):
+        path = self._wds.pop(wd, None)
+        if path is not None:
+            del self._dirs[path]
+
+    def _resync(self):
+        """Compare watched files with the files system state"""
+        events = []
+        self._update_watches()
+        files_list = set(_files_list(self._patterns))
+        for path in tuple(self._files_states):
+            if path not in files_list:
+                del self._files_states[path]
+                self._detector.forget(path)
+                events.append((path, Watch.DELETE))
+        for path in files_list:
+            try:
+                state = self._detector.state(path)
+            except FileNotFoundError:
+                continue
+            if path not in self._files_states:
+                events.append((path, Watch.NEW))
+            elif state != self._files_states[path]:
+                events.append((path, Watch.CHANGE))
+            self._files_states[path] = state
+        return events
+
+
+def default_backend():
+    """Return the most efficient watch backend available
+    on current platform.
+    """
+    if InotifyBackend.is_available():
+        return InotifyBackend
+    return PollingBackend
+
+
 class Watch(threading.Thread):
     """Create and start watch thread that will watch
     files and call given callable if some of the
@@ -149,6 +722,24 @@ class Watch(threading.Thread):
     :param sleep:
         sleep value for watching loop
 
+    :param backend:
+        class of watch backend, :class:`InotifyBackend` or
+        :class:`PollingBackend`. If not given, inotify is used
+        when available, otherwise files are polled.
+
+    :param debounce:
+        if given, actions are gathered until no new action occurs
+        for `debounce` seconds, then they are passed to callbacks at
+        once with repeated actions of the same file merged
+
+    :param batch_callback:
+        callable(events) called with list of (filename, action)
+        tuples, used instead or together with `callback`
+
+    :param detect:
+        'mtime' (default) reports change when file modification time
+        changes, 'hash' only when file content changes
+
     ::
 
         def callback(filename, action):
@@ -158,6 +749,15 @@ class Watch(threading.Thread):
         w = Watch('*.py', callback)
         w.wait()
 
+    Burst of changes (e.g. git checkout) handled by one call::
+
+        def batch_callback(events):
+            for filename, action in events:
+                ...
+
+        w = Watch('*.py', batch_callback=batch_callback, debounce=0.5)
+        w.wait()
+
     """
     #: New file action
     NEW = 1
@@ -166,10 +766,22 @@ class Watch(threading.Thread):
     #: File removed action
     DELETE = 3
 
-    def __init__(self, files, callback, sleep=0.2):
-        self._stopit = False
-        self._files_registered = False
+    def __init__(self, files, callback=None, sleep=0.2, backend=None,
+                 debounce=None, batch_callback=None, detect='mtime'):
+        if callback is None and batch_callback is None:
+            raise TypeError("callback or batch_callback should be given")
+        if detect not in DETECTORS:
+            raise ValueError("detect should be one of %s, %s given" %
+                             (', '.join(sorted(DETECTORS)), detect))
+        self._detector_cls = DETECTORS[detect]
+        self._stopit = threading.Event()
+        self._files_registered = threading.Event()
+        self._dispatched = threading.Condition()
+        self._backend = None
         self._sleep = sleep
+        self._backend_cls = backend or default_backend()
+        self._debounce = debounce
+        self._batch_callback = batch_callback
         super().__init__(target=self.loop, args=(files, callback))
         self.start()
 
@@ -179,24 +791,39 @@ class Watch(threading.Thread):
         """
         if timeout:
             self.join(timeout)
-        self._stopit = True
+        self._stopit.set()
+        backend = self._backend
+        if backend:
+            backend.wakeup()
         self.join()
 
     def stop_when(self, predicate, timeout=None):
         """Stop watch process when callable predicate()
         evaluates to True. If timeout given stop
-        process after given time.
+        process after given time. Predicate is checked
+        each time callbacks were called and at least every
+        sleep seconds (0.1 if sleep is 0).
         """
-        if timeout:
-            start_time = time.time()
-        while not predicate():
-            if timeout and (time.time() - start_time) > timeout:
-                break
+        interval = self._sleep or 0.1
+        deadline = None if timeout is None else time.time() + timeout
+        with self._dispatched:
+            while True:
+                wait_time = interval if deadline is None else \
+                    min(interval, deadline - time.time())
+                if self._dispatched.wait_for(
+                        lambda: predicate() or self._stopit.is_set(),
+                        max(wait_time, 0)):
+                    break
+                if deadline is not None and time.time() >= deadline:
+                    break
         self.stop()
 
-    def wait_for_files_registered(self):
-        while not self._files_registered:
-            pass
+    def wait_for_files_registered(self, timeout=None):
+        """Block until watched files are registered, so that
+        following changes will be noticed. Return False if
+        timeout given and it passed.
+        """
+        return self._files_registered.wait(timeout)
 
     def wait(self):
         """Hold process in the waiting state,
@@ -208,57 +835,84 @@ class Watch(threading.Thread):
             self.stop()
 
     def _files_list(self, pattern):
-        if isinstance(pattern, str):
-            return glob(pattern)
-
-        l = []
-        for p in pattern:
-            l.extend(glob(p))
-
-        return l
+        return _files_list(pattern)
 
     def loop(self, files_pattern, callback):
-        # Registering files
-        files_mtimes = {}
-        files_list = self._files_list(files_pattern)
-
-        for path in files_list:
-            files_mtimes[path] = os.path.getmtime(path)
-
-        self._files_registered = True
-
-        # Watch loop
-        while True:
-            if self._stopit:
-                break
-
-            time.sleep(self._sleep)
-
-            # Checking existing files
-            for path in tuple(files_mtimes.keys()):
-                if self._stopit:
+        detector = self._detector_cls()
+        backend = None
+        try:
+            try:
+                backend = self._backend_cls(files_pattern, self._sleep,
+                                            detector)
+            except OSError:
+                # e.g. inotify instances limit reached
+                backend = PollingBackend(files_pattern, self._sleep, detector)
+            self._backend = backend
+
+            # Registering files
+            backend.register()
+            self._files_registered.set()
+
+            # Watch loop
+            pending = {}
+            last_event_time = None
+            timeout = None
+            while not self._stopit.is_set():
+                events = backend.events(timeout)
+                if self._stopit.is_set():
                     break
-
-                try:
-                    fmtime = os.path.getmtime(path)
-                    if fmtime != files_mtimes[path]:
-                        callback(path, self.CHANGE)
-                        files_mtimes[path] = fmtime
-
-                except FileNotFoundError:
-                    callback(path, self.DELETE)
-                    del files_mtimes[path]
-                    if path in files_list:
-                        files_list.remove(path)
-
-            # Checking new files
-            for path in files_list:
-                if self._stopit:
+                if self._debounce is None:
+                    self._dispatch(events, callback)
+                    continue
+
+                for path, action in events:
+                    self._merge_action(pending, path, action)
+                if events:
+                    last_event_time = time.time()
+                if last_event_time is None:
+                    timeout = None
+                    continue
+                timeout = self._debounce - (time.time() - last_event_time)
+                if timeout <= 0:
+                    self._dispatch(list(pending.items()), callback)
+                    pending = {}
+                    last_event_time = None
+                    timeout = None
+        finally:
+            if backend is not None:
+                backend.close()
+            # Release waiting threads also when loop failed
+            self._stopit.set()
+            self._files_registered.set()
+            with self._dispatched:
+                self._dispatched.notify_all()
+
+    def _dispatch(self, events, callback):
+        if not events:
+            return
+        if self._batch_callback:
+            self._batch_callback(events)
+        if callback:
+            for path, action in events:
+                if self._stopit.is_set():
                     break
-
-                if path not in files_mtimes:
-                    files_mtimes[path] = os.path.getmtime(path)
-                    callback(path, self.NEW)
-
-            # Updating files list
-            files_list = self._files_list(files_pattern)
+                callback(path, action)
+        with self._dispatched:
+            self._dispatched.notify_all()
+
+    @classmethod
+    def _merge_action(cls, pending, path, action):
+        """Merge action with the one already pending for the same
+        file, so that the result describes the whole change.
+        """
+        previous = pending.get(path)
+        if previous is None:
+            pending[path] = action
+        elif previous == cls.NEW:
+            if action == cls.DELETE:
+                del pending[path]
+        elif previous == cls.DELETE:
+            # removed and created again
+            pending[path] = cls.CHANGE
+        else:
+            pending[path] = action
@@ -1,15 +1,31 @@
-import glob
 import os.path
 import re
+import ast
 import importlib
+import importlib.util
+import builtins
 import sys
 import inspect
+import fnmatch
 import traceback
 import time
 import tempfile
 import argparse
 import subprocess
+import multiprocessing
+import json
+import heapq
+import tracemalloc
+import gc
+import signal
+import queue
+import shutil
+import threading
+import atexit
+import collections
+import asyncio
 from unittest import mock
+from xml.sax.saxutils import escape, quoteattr
 from flowp import files
 
 # for traceback passing in test results
@@ -44,10 +60,26 @@ class ColorStream(str):
         self.green(msg)
         self.writeln()
 
+    def isatty(self):
+        isatty = getattr(self._stream, 'isatty', None)
+        return bool(isatty and isatty())
+
     def flush(self):
         self._stream.flush()
 
 
+class NullStream:
+    """Stream which discards everything written to it"""
+    def write(self, msg):
+        pass
+
+    def isatty(self):
+        return False
+
+    def flush(self):
+        pass
+
+
 def only(obj):
     obj._only_mode = True
     return obj
@@ -63,8 +95,313 @@ def slow(obj):
     return obj
 
 
+def before_session(func):
+    """Mark function of spec module to be called once before tests
+    of the run (once in every worker process in parallel mode).
+    """
+    func._session_hook = 'before'
+    return func
+
+
+def after_session(func):
+    """Mark function of spec module to be called once after tests
+    of the run (once in every worker process in parallel mode).
+    """
+    func._session_hook = 'after'
+    return func
+
+
+class Cache:
+    """Values persisted between runs as JSON files in the cache
+    directory (.flowp_cache in the current working directory by
+    default).
+    """
+    def __init__(self, path='.flowp_cache'):
+        self.path = os.path.abspath(path)
+
+    def get(self, key, default=None):
+        try:
+            with open(os.path.join(self.path, key + '.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return default
+
+    def set(self, key, value):
+        """Save value, errors of writing (e.g. read-only directory)
+        are ignored as values are only cached.
+        """
+        filename = os.path.join(self.path, key + '.json')
+        tmp_filename = '%s.%s.tmp' % (filename, os.getpid())
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            with open(tmp_filename, 'w') as f:
+                json.dump(value, f)
+            os.replace(tmp_filename, filename)
+        except OSError:
+            try:
+                os.remove(tmp_filename)
+            except OSError:
+                pass
+
+
+class KeywordExpression:
+    """Expression selecting tests by words of their ids and
+    descriptions, e.g. 'runner and not (slow or "get chunks")'.
+    Words are matched case insensitively as substrings, phrases
+    with spaces can be quoted.
+    """
+    token_re = re.compile(r'\s*(?:([()])|"([^"]*)"|\'([^\']*)\'|'
+                          r'([^\s()"\']+))')
+    operators = ('and', 'or', 'not')
+
+    def __init__(self, expression):
+        self.expression = expression
+        self._tokens = self._tokenize(expression)
+        self._pos = 0
+        self._match = self._parse_or()
+        if self._pos < len(self._tokens):
+            raise ValueError("unexpected '%s' in expression: %s" %
+                             (self._tokens[self._pos][1], expression))
+
+    def _tokenize(self, expression):
+        tokens = []
+        pos = 0
+        expression = expression.rstrip()
+        while pos < len(expression):
+            match = self.token_re.match(expression, pos)
+            if not match:
+                raise ValueError("invalid expression: %s" % expression)
+            paren, double_quoted, quoted, word = match.groups()
+            if paren:
+                tokens.append((paren, paren))
+            elif word is not None and word in self.operators:
+                tokens.append((word, word))
+            else:
+                phrase = [t for t in (double_quoted, quoted, word)
+                          if t is not None][0]
+                tokens.append(('word', phrase.lower()))
+            pos = match.end()
+        return tokens
+
+    def _next(self, kind=None):
+        if self._pos < len(self._tokens):
+            token = self._tokens[self._pos]
+            if kind is None or token[0] == kind:
+                self._pos += 1
+                return token
+        return None
+
+    def _parse_or(self):
+        operands = [self._parse_and()]
+        while self._next('or'):
+            operands.append(self._parse_and())
+        if len(operands) == 1:
+            return operands[0]
+        return lambda text: any(operand(text) for operand in operands)
+
+    def _parse_and(self):
+        operands = [self._parse_not()]
+        while self._next('and'):
+            operands.append(self._parse_not())
+        if len(operands) == 1:
+            return operands[0]
+        return lambda text: all(operand(text) for operand in operands)
+
+    def _parse_not(self):
+        if self._next('not'):
+            operand = self._parse_not()
+            return lambda text: not operand(text)
+        if self._next('('):
+            operand = self._parse_or()
+            if not self._next(')'):
+                raise ValueError("missing ')' in expression: %s" %
+                                 self.expression)
+            return operand
+        token = self._next('word')
+        if token is None:
+            raise ValueError("unexpected end of expression: %s" %
+                             self.expression)
+        word = token[1]
+        return lambda text: word in text
+
+    def match(self, text):
+        return self._match(text.lower())
+
+
+class ImportsRecorder:
+    """Context manager which records which modules are imported
+    by which modules while it's active.
+    """
+    def __init__(self):
+        # importer module name -> set of imported modules names
+        self.imports = {}
+        self._original_import = None
+
+    def __enter__(self):
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._import
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        builtins.__import__ = self._original_import
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        module = self._original_import(name, globals, locals, fromlist, level)
+        if globals and globals.get('__name__'):
+            try:
+                self._record(globals, name, fromlist, level)
+            except (ImportError, ValueError):
+                pass
+        return module
+
+    def _record(self, importer_globals, name, fromlist, level):
+        if level:
+            package = importer_globals.get('__package__') or \
+                importer_globals['__name__'].rpartition('.')[0]
+            name = importlib.util.resolve_name('.' * level + name, package)
+        imported = self.imports.setdefault(importer_globals['__name__'],
+                                           set())
+        # Packages of imported module are executed too
+        parts = name.split('.')
+        for i in range(1, len(parts) + 1):
+            imported.add('.'.join(parts[:i]))
+        for attr_name in fromlist or ():
+            submodule = '%s.%s' % (name, attr_name)
+            if submodule in sys.modules:
+                imported.add(submodule)
+
+    def get_dependencies(self, module_name, follow=None):
+        """Return names of all modules imported directly or
+        indirectly by given module (including itself).
+
+        :param follow:
+            callable(module_name), imports of module are followed
+            only if it evaluates to True
+        """
+        dependencies = set()
+        to_visit = [module_name]
+        while to_visit:
+            name = to_visit.pop()
+            if name in dependencies:
+                continue
+            dependencies.add(name)
+            if follow and not follow(name):
+                continue
+            if name in self.imports:
+                to_visit.extend(self.imports[name])
+            else:
+                to_visit.extend(self._get_references(name))
+        return dependencies
+
+    def _get_references(self, module_name):
+        """Guess imports of module imported before recording started
+        from modules, classes and functions in its namespace.
+        """
+        module = sys.modules.get(module_name)
+        references = set()
+        for value in list(getattr(module, '__dict__', {}).values()):
+            if inspect.ismodule(value):
+                # Imported submodules are set as package attributes,
+                # package doesn't depend on them
+                if not value.__name__.startswith(module_name + '.'):
+                    references.add(value.__name__)
+            elif inspect.isclass(value) or inspect.isfunction(value):
+                references.add(value.__module__)
+        return references
+
+
+class TemporaryDirectoriesPool:
+    """Temporary directories created in advance, on tmpfs if it's
+    available. Released directories which are empty are reused,
+    others are deleted by a background thread which creates new ones
+    in their place. Every process (e.g. forked worker) uses its own
+    subdirectory of the pool directory.
+    """
+    #: Directories which are tried as a place for the pool
+    tmpfs_dirs = ('/dev/shm',)
+
+    def __init__(self, size=4, root=None):
+        self.size = size
+        self.path = tempfile.mkdtemp(prefix='flowp-', dir=root or
+                                     self.get_root())
+        self._owner_pid = os.getpid()
+        self._pid = None
+        self._thread = None
+        atexit.register(self.remove)
+
+    def get_root(self):
+        for path in self.tmpfs_dirs:
+            if os.path.isdir(path) and os.access(path, os.W_OK | os.X_OK):
+                return path
+        return None
+
+    def _start(self):
+        self._pid = os.getpid()
+        self._dir = tempfile.mkdtemp(prefix='%s-' % self._pid, dir=self.path)
+        self._ready = collections.deque()
+        self._trash = queue.Queue()
+        self._thread = threading.Thread(target=self._clean, daemon=True)
+        self._thread.start()
+
+    def _clean(self):
+        while len(self._ready) < self.size:
+            self._ready.append(tempfile.mkdtemp(dir=self._dir))
+        for path in iter(self._trash.get, None):
+            shutil.rmtree(path, ignore_errors=True)
+            if len(self._ready) < self.size:
+                self._ready.append(tempfile.mkdtemp(dir=self._dir))
+
+    def acquire(self):
+        """Return path of an empty directory"""
+        if self._pid != os.getpid():
+            # Threads aren't inherited by forked processes
+            self._start()
+        try:
+            return self._ready.pop()
+        except IndexError:
+            return tempfile.mkdtemp(dir=self._dir)
+
+    def release(self, path):
+        """Give the directory back to the pool"""
+        if self._pid != os.getpid():
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+        with os.scandir(path) as entries:
+            empty = next(entries, None) is None
+        if empty and len(self._ready) < self.size:
+            self._ready.append(path)
+        else:
+            self._trash.put(path)
+
+    def close(self):
+        """Wait for deletion of released directories and remove
+        directories of the current process which aren't in use.
+        Pool can be used again.
+        """
+        if self._pid != os.getpid():
+            return None
+        self._trash.put(None)
+        self._thread.join()
+        for path in list(self._ready) + [self._dir]:
+            try:
+                os.rmdir(path)
+            except OSError:
+                pass
+        self._pid = None
+        self._thread = None
+
+    def remove(self):
+        """Remove the pool directory"""
+        self.close()
+        if self._owner_pid == os.getpid():
+            shutil.rmtree(self.path, ignore_errors=True)
+
+
 class TemporaryDirectory:
     """tempfile.TemporaryDirectory proxy"""
+    #: TemporaryDirectoriesPool used instead of tempfile if set
+    pool = None
+
     def __init__(self):
         self._tmpdir = None
         self._org_cwd = None
@@ -74,7 +411,10 @@ class TemporaryDirectory:
         directory to it, remembering the original one.
         """
         self._org_cwd = os.getcwd()
-        self._tmpdir = tempfile.TemporaryDirectory()
+        if self.pool:
+            self._tmpdir = _PooledDirectory(self.pool)
+        else:
+            self._tmpdir = tempfile.TemporaryDirectory()
         os.chdir(self._tmpdir.name)
 
     def exit(self):
@@ -91,13 +431,285 @@ class TemporaryDirectory:
         return self._tmpdir.name
 
 
+class _PooledDirectory:
+    def __init__(self, pool: TemporaryDirectoriesPool):
+        self._pool = pool
+        self.name = pool.acquire()
+
+    def cleanup(self):
+        if self.name:
+            self._pool.release(self.name)
+            self.name = None
+
+
+class EventLoop:
+    """asyncio event loop reused by async tests and hooks of the
+    process, forked processes create their own one.
+    """
+    _loop = None
+    _pid = None
+
+    @classmethod
+    def get(cls):
+        if cls._loop is None or cls._pid != os.getpid():
+            cls._loop = asyncio.new_event_loop()
+            cls._pid = os.getpid()
+        return cls._loop
+
+    @classmethod
+    def run(cls, awaitable):
+        return cls.get().run_until_complete(awaitable)
+
+    @classmethod
+    def close(cls):
+        if cls._loop is not None and cls._pid == os.getpid():
+            cls._loop.run_until_complete(cls._loop.shutdown_asyncgens())
+            cls._loop.close()
+        cls._loop = None
+
+
+def _complete(result):
+    """Run result of async function to completion"""
+    if inspect.isawaitable(result):
+        return EventLoop.run(result)
+    return result
+
+
+async def _await(result):
+    if inspect.isawaitable(result):
+        return await result
+    return result
+
+
+class Benchmark:
+    """Time a function repeatedly. Function is called for warm up
+    first, then number of its calls in one timing is calibrated, so
+    that the timing takes at least min_time. Garbage collector is
+    disabled during timings.
+
+    :param baseline: statistics of the benchmark to compare with
+    :param max_ratio:
+        ratio of median time to the baseline one above which
+        benchmark fails
+    """
+    # for passing traceback purpose
+    TESTING_FRAME = True
+
+    def __init__(self, repeat=7, min_time=0.02, warmup_time=0.05,
+                 baseline=None, max_ratio=None):
+        self.repeat = repeat
+        self.min_time = min_time
+        self.warmup_time = warmup_time
+        self.baseline = baseline
+        self.max_ratio = max_ratio
+
+    def measure(self, func):
+        """Return statistics of function call times: median, IQR
+        (interquartile range), ops (calls per second), calls (number
+        of calls in one timing) and repeat (number of timings).
+        """
+        if inspect.iscoroutinefunction(func):
+            async_func = func
+            func = lambda: EventLoop.run(async_func())
+        self.warm_up(func)
+        calls = self.calibrate(func)
+        times = sorted(self._time(func, calls) / calls
+                       for _ in range(self.repeat))
+        median = self._percentile(times, 0.5)
+        return {
+            'median': median,
+            'iqr': self._percentile(times, 0.75) -
+            self._percentile(times, 0.25),
+            'ops': 1 / median if median else float('inf'),
+            'calls': calls,
+            'repeat': self.repeat,
+        }
+
+    def warm_up(self, func):
+        end_time = time.perf_counter() + self.warmup_time
+        while True:
+            func()
+            if time.perf_counter() >= end_time:
+                break
+
+    def calibrate(self, func):
+        """Return number of calls which take at least min_time"""
+        calls = 1
+        while True:
+            for multiplier in (1, 2, 5):
+                number = calls * multiplier
+                if self._time(func, number) >= self.min_time:
+                    return number
+            calls *= 10
+
+    def check(self, stats):
+        """Fail if median time regressed past max_ratio of the
+        baseline one.
+        """
+        if not self.baseline or self.max_ratio is None:
+            return None
+        ratio = stats['median'] / self.baseline['median']
+        if ratio > self.max_ratio:
+            raise AssertionError(
+                'median %s is %.2fx of baseline %s, expected at most '
+                '%.2fx' % (format_time(stats['median']), ratio,
+                           format_time(self.baseline['median']),
+                           self.max_ratio))
+
+    def _time(self, func, calls):
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            start_time = time.perf_counter()
+            for _ in range(calls):
+                func()
+            return time.perf_counter() - start_time
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    @staticmethod
+    def _percentile(values, fraction):
+        """Linearly interpolated percentile of sorted values"""
+        position = (len(values) - 1) * fraction
+        lower = int(position)
+        upper = min(lower + 1, len(values) - 1)
+        return values[lower] + (values[upper] - values[lower]) * \
+            (position - lower)
+
+
+def format_time(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return '%.3g %s' % (seconds / scale, unit)
+    return '%.3g ns' % (seconds * 1e9)
+
+
+class Fixtures:
+    """Set up shared fixtures (before_all methods of behaviors and
+    session hooks) before the first test which needs them, tear them
+    down (after_all methods) when tests of other behavior are run or
+    on close. Tests are expected to be run in order they are loaded,
+    so tests of one behavior follow each other.
+    """
+    #: Attributes of fixture behavior instance which aren't shared
+    private_attributes = ('method_name', '_results', '_patchers', 'tmpdir',
+                          '_benchmark')
+
+    def __init__(self, session_hooks=()):
+        self.session_hooks = list(session_hooks)
+        self.last_behavior = None
+        self._session_started = False
+        self._session_exc_info = None
+        # [(behavior class, fixture behavior, shared attributes, exc_info)]
+        self._stack = []
+
+    def enter(self, behavior):
+        """Set up fixtures of the behavior and share their attributes
+        with it. Return exc_info of failed set up, None on success.
+        """
+        if not self._session_started:
+            self._session_started = True
+            self._session_exc_info = self._call_hooks('before')
+
+        chain = behavior.parent_behaviors + (behavior.__class__,)
+        depth = 0
+        while depth < min(len(self._stack), len(chain)) and \
+                self._stack[depth][0] is chain[depth]:
+            depth += 1
+        # Failures of tear down belong to the previous test
+        self._tear_down(depth)
+        self.last_behavior = behavior
+        for behavior_class in chain[depth:]:
+            if self._stack:
+                _, _, attributes, exc_info = self._stack[-1]
+            else:
+                attributes, exc_info = {}, self._session_exc_info
+            fixture = None
+            if exc_info is None:
+                fixture = behavior_class(None, behavior._results)
+                fixture.__dict__.update(attributes)
+                try:
+                    _complete(fixture.before_all())
+                except:
+                    exc_info = sys.exc_info()
+                attributes = dict(
+                    (name, value) for name, value in fixture.__dict__.items()
+                    if name not in self.private_attributes)
+            self._stack.append((behavior_class, fixture, attributes,
+                                exc_info))
+
+        _, _, attributes, exc_info = self._stack[-1]
+        behavior.__dict__.update(attributes)
+        return exc_info
+
+    def close(self):
+        """Tear down all fixtures, failures are added to results of
+        the last entered behavior.
+        """
+        self._tear_down(0)
+        if self._session_started:
+            self._session_started = False
+            exc_info = self._call_hooks('after')
+            if exc_info is not None:
+                self._add_failure(exc_info)
+
+    def _tear_down(self, depth):
+        while len(self._stack) > depth:
+            _, fixture, _, _ = self._stack.pop()
+            if fixture is None:
+                continue
+            try:
+                try:
+                    _complete(fixture.after_all())
+                finally:
+                    fixture._stop_patchers()
+            except:
+                self._add_failure(sys.exc_info())
+
+    def _call_hooks(self, kind):
+        """Call session hooks of given kind, return exc_info of
+        the first failed one.
+        """
+        hooks = [hook for hook in self.session_hooks
+                 if hook._session_hook == kind]
+        if kind == 'after':
+            hooks.reverse()
+        first_exc_info = None
+        for hook in hooks:
+            try:
+                _complete(hook())
+            except:
+                first_exc_info = first_exc_info or sys.exc_info()
+                if kind == 'before':
+                    break
+        return first_exc_info
+
+    def _add_failure(self, exc_info):
+        behavior = self.last_behavior
+        behavior._results.add_failure(exc_info, behavior)
+
+
 class Behavior:
     """Test case"""
     parent_behaviors = tuple()
+    #: Maximal number of async tests of the behavior which
+    #: are run concurrently
+    concurrency = 1
+    #: Benchmarks (bench_ methods): number of timings, minimal time
+    #: of one timing, time of warm up and ratio of median time to
+    #: the baseline one above which benchmark fails
+    bench_repeat = 7
+    bench_min_time = 0.02
+    bench_warmup_time = 0.05
+    bench_max_ratio = 1.5
+    # Benchmark which runs bench_ method, set by runner
+    _benchmark = None
 
     def __init__(self, method_name, results):
         self.method_name = method_name
         self._results = results
+        self._patchers = []
         self.tmpdir = TemporaryDirectory()
 
     def _have_only_mode(self):
@@ -130,57 +742,200 @@ class Behavior:
     def after_each(self):
         pass
 
+    def before_all(self):
+        """Called once before tests of the behavior and its nested
+        behaviors (once in every worker process which runs some of them
+        in parallel mode). Attributes set on self are shared by the tests.
+        """
+        pass
+
+    def after_all(self):
+        """Called once after tests of the behavior and its nested
+        behaviors.
+        """
+        pass
+
+    def _get_test_id(self):
+        """Return identifier of the test which is the same between
+        runs: module:Behavior.NestedBehavior.it_method_name
+        """
+        top_behavior = (self.parent_behaviors[0] if self.parent_behaviors
+                        else self.__class__)
+        path = [pbehavior.__name__ for pbehavior in self.parent_behaviors]
+        path.append(self.__class__.__name__)
+        return '%s:%s.%s' % (top_behavior.__module__, '.'.join(path),
+                             self.method_name)
+
     def _call_before_each_methods(self):
         for parent_behavior in self.parent_behaviors:
-            parent_behavior.before_each(self)
-        self.before_each()
+            _complete(parent_behavior.before_each(self))
+        _complete(self.before_each())
 
     def _call_after_each_methods(self):
-        self.after_each()
+        _complete(self.after_each())
         for parent_behavior in reversed(self.parent_behaviors):
-            parent_behavior.after_each(self)
+            _complete(parent_behavior.after_each(self))
 
-    def run(self, only_mode=False, fast_mode=False):
-        """Run specific test"""
-        method = getattr(self, self.method_name)
-        self._results.start_test()
+    async def _await_before_each_methods(self):
+        for parent_behavior in self.parent_behaviors:
+            await _await(parent_behavior.before_each(self))
+        await _await(self.before_each())
+
+    async def _await_after_each_methods(self):
+        await _await(self.after_each())
+        for parent_behavior in reversed(self.parent_behaviors):
+            await _await(parent_behavior.after_each(self))
+
+    def _tear_down(self, timings):
+        try:
+            self._call_timed(timings, 'after_each',
+                             self._call_after_each_methods)
+        finally:
+            self._stop_patchers()
+
+    async def _await_tear_down(self, timings):
+        try:
+            await self._await_timed(timings, 'after_each',
+                                    self._await_after_each_methods)
+        finally:
+            self._stop_patchers()
+
+    def _stop_patchers(self):
+        """Stop patchers started by mock method in reversed order"""
+        exc_info = None
+        while self._patchers:
+            try:
+                self._patchers.pop().stop()
+            except:
+                exc_info = exc_info or sys.exc_info()
+        if exc_info:
+            raise exc_info[1]
+
+    def _call_timed(self, timings, phase, func):
+        start_time = time.perf_counter()
+        try:
+            return _complete(func())
+        finally:
+            timings[phase] = time.perf_counter() - start_time
+
+    async def _await_timed(self, timings, phase, func):
+        start_time = time.perf_counter()
+        try:
+            return await _await(func())
+        finally:
+            timings[phase] = time.perf_counter() - start_time
+
+    def _should_run(self, method, only_mode, fast_mode):
+        """Check if test should be run, count it as skipped if not"""
         if only_mode and (not hasattr(method, '_only_mode') and
                           not self._have_only_mode()):
-            self._results.add_skipped()
-            return None
+            self._results.add_skipped(self)
+            return False
         if self._is_skipped() or hasattr(method, '_skipped'):
-            self._results.add_skipped()
-            return None
+            self._results.add_skipped(self)
+            return False
         if fast_mode and (hasattr(method, '_slow') or
                           self._is_slow()):
-            self._results.add_skipped_slow()
+            self._results.add_skipped_slow(self)
+            return False
+        return True
+
+    def _run_benchmark(self, method):
+        stats = self._benchmark.measure(method)
+        self._results.benchmarks[self._get_test_id()] = stats
+        self._benchmark.check(stats)
+
+    def _stop_test(self, timings, start_time):
+        self._results.stop_test(self, timings, start_time=start_time)
+        self._results.print_progress()
+
+    def run(self, only_mode=False, fast_mode=False, fixtures=None):
+        """Run specific test
+
+        :param fixtures:
+            Fixtures which set up before_all methods and session hooks
+        """
+        method = getattr(self, self.method_name)
+        start_time = self._results.start_test(self)
+        if not self._should_run(method, only_mode, fast_mode):
             return None
 
+        timings = {}
         try:
             self._results.add_executed()
-            self._call_before_each_methods()
-            method()
+            if fixtures is not None:
+                exc_info = fixtures.enter(self)
+                if exc_info is not None:
+                    self._results.add_failure(exc_info, self)
+                    return None
+            self._call_timed(timings, 'before_each',
+                             self._call_before_each_methods)
+            if self._benchmark is None:
+                self._call_timed(timings, 'test', method)
+            else:
+                self._call_timed(timings, 'test',
+                                 lambda: self._run_benchmark(method))
 
         # Catching exceptions
         except:
+            exc_info = sys.exc_info()
+            try:
+                self._tear_down(timings)
+            except:
+                self._results.add_failure(sys.exc_info(), self)
+            else:
+                self._results.add_failure(exc_info, self)
+        else:
             try:
-                self._call_after_each_methods()
-                mock.patch.stopall()
+                self._tear_down(timings)
             except:
                 self._results.add_failure(sys.exc_info(), self)
             else:
+                self._results.add_success()
+        finally:
+            self._stop_test(timings, start_time)
+
+    async def run_async(self, only_mode=False, fast_mode=False,
+                        fixtures=None):
+        """Run specific test in the running event loop, so that async
+        tests can be run concurrently. Fixtures have to be set up
+        already.
+        """
+        method = getattr(self, self.method_name)
+        start_time = self._results.start_test(self)
+        if not self._should_run(method, only_mode, fast_mode):
+            return None
+
+        timings = {}
+        try:
+            self._results.add_executed()
+            if fixtures is not None:
+                exc_info = fixtures.enter(self)
+                if exc_info is not None:
+                    self._results.add_failure(exc_info, self)
+                    return None
+            await self._await_timed(timings, 'before_each',
+                                    self._await_before_each_methods)
+            await self._await_timed(timings, 'test', method)
+
+        # Catching exceptions
+        except:
+            exc_info = sys.exc_info()
+            try:
+                await self._await_tear_down(timings)
+            except:
                 self._results.add_failure(sys.exc_info(), self)
+            else:
+                self._results.add_failure(exc_info, self)
         else:
             try:
-                self._call_after_each_methods()
-                mock.patch.stopall()
+                await self._await_tear_down(timings)
             except:
                 self._results.add_failure(sys.exc_info(), self)
             else:
                 self._results.add_success()
         finally:
-            if self._results.executed < self._results.all:
-                self._results.print_execution_info(in_place=True)
+            self._stop_test(timings, start_time)
 
     def mock(self, target=None, attr=None, new=mock.DEFAULT, spec=None):
         """Create a mock and register it in behavior mocks manager.
@@ -208,94 +963,409 @@ class Behavior:
             patcher = mock.patch(target, new=new, spec=spec)
 
         if patcher:
-            return patcher.start()
+            mock_obj = patcher.start()
+            self._patchers.append(patcher)
+            return mock_obj
         return mock.Mock(spec=spec)
 
 
+class Failure:
+    """Failure of a test. Frames of the traceback are summarized
+    without source lines and traceback text is formatted only when
+    it's needed. Failures with the same exception type raised in the
+    same place have equal keys. Failure is made of strings and frames
+    summaries, so it's pickled by workers without formatting.
+
+    :param limit: number of traceback levels to keep
+    """
+    header = 'Traceback (most recent call last):\n'
+    cause_message = '\nThe above exception was the direct cause ' \
+        'of the following exception:\n\n'
+    context_message = '\nDuring handling of the above exception, ' \
+        'another exception occurred:\n\n'
+
+    def __init__(self, exc_type, exc_value, tb, limit=None):
+        exception = traceback.TracebackException(
+            exc_type, exc_value, tb, limit=limit, lookup_lines=False)
+        stack = exception.stack
+        self.exc_type = exc_type.__name__
+        #: (filename, line) where exception was raised
+        self.location = (stack[-1].filename, stack[-1].lineno) \
+            if stack else None
+        #: Last line of formatted exception, e.g. 'ValueError: message'
+        self.message = list(exception.format_exception_only())[-1].strip()
+        self._chain = self._get_chain(exception)
+        self._text = None
+
+    def _get_chain(self, exception):
+        """Return [(chain message, stack, exception lines)] of chained
+        exceptions, from the raised one to the first one
+        """
+        chain = []
+        while exception is not None:
+            if getattr(exception, 'exceptions', None) is not None:
+                # Exception group, formatted with its exceptions
+                stack = None
+                lines = list(exception.format(chain=False))
+            else:
+                stack = exception.stack
+                lines = list(exception.format_exception_only())
+            if exception.__cause__ is not None:
+                message = self.cause_message
+                exception = exception.__cause__
+            elif exception.__context__ is not None and \
+                    not exception.__suppress_context__:
+                message = self.context_message
+                exception = exception.__context__
+            else:
+                message = None
+                exception = None
+            chain.append((message, stack, lines))
+        return chain
+
+    @property
+    def key(self):
+        return (self.exc_type, self.location)
+
+    def get_summary(self):
+        """Return formatted exception with its location in one line"""
+        if self.location is None:
+            return self.message
+        return '%s (%s:%s)' % ((self.message,) + self.location)
+
+    def __str__(self):
+        if self._text is None:
+            msg_lines = []
+            for message, stack, lines in reversed(self._chain):
+                if message is not None:
+                    msg_lines.append(message)
+                if stack:
+                    msg_lines.append(self.header)
+                    msg_lines.extend(stack.format())
+                msg_lines.extend(lines)
+            if msg_lines[0] == self.header:
+                msg_lines = msg_lines[1:]
+            msg_lines[-1] = '  ' + msg_lines[-1]
+            self._text = ''.join(msg_lines)
+            self._chain = None
+        return self._text
+
+
 class Results:
     """Gather informations about test results"""
-    def __init__(self):
-        self.stream = ColorStream(sys.stdout)
+    #: How many times per second progress is redrawn on terminal
+    progress_rate = 10
+    #: Seconds between progress summaries written to other streams
+    summary_interval = 10
+    #: Failures printed with traceback, others are summed up in a line
+    max_printed_failures = 30
+
+    def __init__(self, stream=None):
+        self.stream = ColorStream(stream or sys.stdout)
+        self._is_tty = self.stream.isatty()
+        self._last_progress_time = time.perf_counter()
         self.failures = []
         self.skipped = 0
         self.executed = 0
         self.all = 0
         self.skipped_slow = 0
-
-    def start_test(self):
-        pass
-
-    def stop_test(self):
-        pass
+        # test id -> wall time of executed tests
+        self.durations = {}
+        # test id -> (before_each, test, after_each) times
+        self.timings = {}
+        # test id -> (peak, retained) memory allocated by the test
+        self.memory = {}
+        # test id -> statistics of benchmark (see Benchmark.measure)
+        self.benchmarks = {}
+        self._test_start_time = None
+        # run was stopped after max failures
+        self.stopped = False
+        #: Reporters which get result of every test when it completes
+        self.reporters = []
+        # id of running behavior -> its failure
+        self._running = {}
+        # test id -> status of reported tests
+        self.statuses = {}
+
+    def report(self, behavior, status, duration=0.0, err=None):
+        """Pass result of the test to reporters
+
+        :param status:
+            'passed', 'failed', 'skipped', 'skipped_slow' or 'error'
+            of already finished test (see Reporter.add_error)
+        """
+        if status == 'error':
+            self.statuses[behavior._get_test_id()] = 'failed'
+            for reporter in self.reporters:
+                reporter.add_error(behavior, err)
+            return None
+        self.statuses[behavior._get_test_id()] = status
+        for reporter in self.reporters:
+            reporter.add_result(behavior, status, duration, err)
+
+    def start_test(self, behavior=None):
+        """Return start time of the test"""
+        if behavior is not None:
+            self._running[id(behavior)] = None
+        self._test_start_time = time.perf_counter()
+        return self._test_start_time
+
+    def stop_test(self, behavior, timings, start_time=None):
+        """Record times of executed test
+
+        :param timings:
+            dict of 'before_each', 'test' and 'after_each' phases
+            wall times (phases which weren't reached are missing)
+        :param start_time:
+            time returned by start_test, needed when tests
+            are run concurrently
+        """
+        test_id = behavior._get_test_id()
+        if start_time is None:
+            start_time = self._test_start_time
+        self.durations[test_id] = time.perf_counter() - start_time
+        self.timings[test_id] = (timings.get('before_each', 0.0),
+                                 timings.get('test', 0.0),
+                                 timings.get('after_each', 0.0))
+        err = self._running.pop(id(behavior), None)
+        self.report(behavior, 'failed' if err else 'passed',
+                    self.durations[test_id], err)
 
     def add_success(self):
         pass
 
-    def add_skipped(self):
+    def add_skipped(self, behavior=None):
         self.skipped += 1
+        if behavior is not None:
+            self._running.pop(id(behavior), None)
+            self.report(behavior, 'skipped')
 
-    def add_skipped_slow(self):
+    def add_skipped_slow(self, behavior=None):
         self.skipped_slow += 1
+        if behavior is not None:
+            self._running.pop(id(behavior), None)
+            self.report(behavior, 'skipped_slow')
 
     def add_executed(self):
         self.executed += 1
 
     def add_failure(self, exc_info, behavior):
-        self.failures.append((self._exc_info_to_string(exc_info), behavior))
+        err = self._get_failure(exc_info)
+        self.failures.append((err, behavior))
+        if id(behavior) in self._running:
+            self._running[id(behavior)] = err
+        else:
+            # Failure of after_all method of already finished test
+            self.report(behavior, 'error', err=err)
 
-    def get_behaviors_description(self, behavior: Behavior):
-        description = ''
+    def get_summary(self, tests_indexes, reports=()):
+        """Return picklable summary of results, failed behaviors
+        are given by their indexes (see :meth:`merge`).
 
-        for parent_behavior in behavior.parent_behaviors:
-            description += parent_behavior.__name__
+        :param reports: results recorded by ReportsRecorder
+        """
+        return {
+            'executed': self.executed,
+            'skipped': self.skipped,
+            'skipped_slow': self.skipped_slow,
+            'failures': [(tests_indexes[id(behavior)], err)
+                         for err, behavior in self.failures],
+            'durations': self.durations,
+            'timings': self.timings,
+            'memory': self.memory,
+            'benchmarks': self.benchmarks,
+            'stopped': self.stopped,
+            'reports': [(tests_indexes[id(behavior)], status, duration, err)
+                        for behavior, status, duration, err in reports],
+        }
+
+    def merge(self, summary):
+        """Add counters from other results summary"""
+        self.executed += summary['executed']
+        self.skipped += summary['skipped']
+        self.skipped_slow += summary['skipped_slow']
+        self.durations.update(summary['durations'])
+        self.timings.update(summary['timings'])
+        self.memory.update(summary['memory'])
+        self.benchmarks.update(summary['benchmarks'])
+        self.stopped = self.stopped or summary['stopped']
 
-        description += behavior.__class__.__name__
+    def get_behaviors_description(self, behavior: Behavior):
+        names = [pbehavior.__name__ for pbehavior in behavior.parent_behaviors]
+        names.append(behavior.__class__.__name__)
+        return self.describe_behaviors(names)
+
+    @classmethod
+    def describe_test(cls, behavior: Behavior):
+        names = [pbehavior.__name__ for pbehavior in behavior.parent_behaviors]
+        names.append(behavior.__class__.__name__)
+        method_name = behavior.method_name
+        if method_name.startswith('it_'):
+            method_name = method_name[3:]
+        method_name = method_name.replace('_', ' ')
+        return cls.describe_behaviors(names) + ' ' + method_name
+
+    @staticmethod
+    def describe_behaviors(names):
+        description = ''.join(names)
         # Transform camel case to spaces
         description = re.sub('([a-z0-9])([A-Z])', r'\1 \2', description).lower().capitalize()
         return description
 
     def print_execution_info(self, in_place=False):
         failures = len(self.failures)
-        if in_place:
-            self.stream.write('\r')
-        self.stream.write('Executed %s of %s ' % (self.executed, self.all))
+        stream = self.stream
+        # Written at once, it's printed often
+        info = ['\r' if in_place else '',
+                'Executed %s of %s ' % (self.executed, self.all)]
         if self.skipped:
-            self.stream.write('(%s skipped) ' % self.skipped)
+            info.append('(%s skipped) ' % self.skipped)
         if self.skipped_slow:
-            self.stream.write('(%s too slow) ' % self.skipped_slow)
+            info.append('(%s too slow) ' % self.skipped_slow)
         if failures:
-            self.stream.red('(%s FAILED) ' % failures)
+            info.append(stream.RED + '(%s FAILED) ' % failures +
+                        stream.COLOR_END)
         else:
-            self.stream.green('SUCCESS ')
+            info.append(stream.GREEN + 'SUCCESS ' + stream.COLOR_END)
+        if self.stopped:
+            info.append(stream.RED + '(STOPPED) ' + stream.COLOR_END)
+        stream.write(''.join(info))
+
+    def print_progress(self):
+        """Print execution info of not finished run. On terminal it's
+        redrawn in place at most progress_rate times per second, to
+        other streams it's written in new line every summary_interval
+        seconds.
+        """
+        if self.executed >= self.all:
+            return None
+        now = time.perf_counter()
+        interval = 1 / self.progress_rate if self._is_tty \
+            else self.summary_interval
+        if now - self._last_progress_time < interval:
+            return None
+        self._last_progress_time = now
+        self.print_execution_info(in_place=self._is_tty)
+        if not self._is_tty:
+            self.stream.writeln()
+        self.stream.flush()
 
     def print(self, time_taken):
         # clean line
-        self.stream.write('\r')
-        if self.failures:
-            self.stream.write(' ' * 80)
+        if self._is_tty:
+            self.stream.write('\r')
+            if self.failures:
+                self.stream.write(' ' * 80)
 
         # failures
-        for err, behavior in self.failures:
-            method_name = behavior.method_name[3:].replace('_', ' ')
-            description = self.get_behaviors_description(behavior) + ' ' + method_name
+        for i, (err, behaviors) in enumerate(self.group_failures()):
+            description = self.describe_test(behaviors[0])
             self.stream.red("\n%s FAILED\n" % description)
-            self.stream.write("%s\n" % err)
+            if i < self.max_printed_failures:
+                self.stream.write("%s\n" % err)
+            else:
+                self.stream.write("  %s\n" % err.get_summary())
+            if len(behaviors) > 1:
+                self.stream.write("  The same failure in %s other tests:\n"
+                                  % (len(behaviors) - 1))
+                for behavior in behaviors[1:]:
+                    self.stream.write("    %s\n" %
+                                      self.describe_test(behavior))
 
         # sum up
         self.print_execution_info()
         self.stream.writeln('(%.3f sec)' % time_taken)
 
-    def _exc_info_to_string(self, err):
-        """Converts a sys.exc_info()-style tuple of values into a string."""
+    def print_memory(self, count, growing=None):
+        """Print `count` tests which allocated the most memory, 0 means
+        all of them, and tests whose retained memory grows.
+
+        :param growing:
+            {test id: retained memory in previous runs and this one}
+        """
+        count = count or len(self.memory)
+        top = sorted(self.memory.items(), key=lambda item: item[1],
+                     reverse=True)[:count]
+        self.stream.writeln('\nTop allocating tests:')
+        for test_id, (peak, retained) in top:
+            self.stream.writeln('%10s peak %10s retained  %s' % (
+                self.format_size(peak), self.format_size(retained), test_id))
+        if growing:
+            self.stream.redln('\nTests whose retained memory grows '
+                              'across runs:')
+            for test_id, history in sorted(growing.items()):
+                self.stream.writeln('  %s (%s)' % (test_id, ', '.join(
+                    self.format_size(size) for size in history)))
+
+    def print_benchmarks(self, baseline=None):
+        """Print statistics of benchmarks compared with baseline
+
+        :param baseline: {test id: statistics} of previous run
+        """
+        baseline = baseline or {}
+        self.stream.writeln('\nBenchmarks:')
+        for test_id, stats in sorted(self.benchmarks.items()):
+            line = '%10s \u00b1 %-10s %12.1f ops/s  %s' % (
+                format_time(stats['median']), format_time(stats['iqr']),
+                stats['ops'], test_id)
+            if baseline.get(test_id):
+                line += ' (%.2fx of baseline)' % (
+                    stats['median'] / baseline[test_id]['median'])
+            self.stream.writeln(line)
+
+    @staticmethod
+    def format_size(size):
+        for unit in ('B', 'KiB', 'MiB'):
+            if abs(size) < 1024:
+                break
+            size /= 1024
+        else:
+            unit = 'GiB'
+        return '%.1f %s' % (size, unit) if unit != 'B' \
+            else '%d B' % size
+
+    def group_failures(self):
+        """Return list of (failure, behaviors) of failures with the
+        same key, in order of their first occurrence.
+        """
+        groups = collections.OrderedDict()
+        for err, behavior in self.failures:
+            group = groups.setdefault(err.key, (err, []))
+            group[1].append(behavior)
+        return list(groups.values())
+
+    def print_durations(self, count):
+        """Print `count` slowest tests and `count` slowest
+        before_each setups, 0 means all of them.
+        """
+        count = count or len(self.durations)
+        slowest = sorted(self.durations.items(),
+                         key=lambda item: item[1], reverse=True)[:count]
+        self.stream.writeln('\nSlowest tests:')
+        for test_id, duration in slowest:
+            before_each, test, after_each = self.timings[test_id]
+            self.stream.writeln(
+                '%8.3fs  %s (before_each %.3fs, test %.3fs, '
+                'after_each %.3fs)' % (duration, test_id, before_each,
+                                       test, after_each))
+
+        slowest = sorted(self.timings.items(),
+                         key=lambda item: item[1][0], reverse=True)[:count]
+        self.stream.writeln('\nSlowest before_each setups:')
+        for test_id, timings in slowest:
+            self.stream.writeln('%8.3fs  %s' % (timings[0], test_id))
+
+    def _get_failure(self, err):
+        """Converts a sys.exc_info()-style tuple of values into
+        a Failure.
+        """
         exctype, value, tb = err
-        # Skip test runner traceback levels
-        while tb and self._is_relevant_tb_level(tb):
+        # Skip test runner and event loop traceback levels
+        while tb and (self._is_relevant_tb_level(tb) or
+                      _is_event_loop_frame(tb.tb_frame)):
             tb = tb.tb_next
         length = self._count_relevant_tb_levels(tb)
-        msg_lines = traceback.format_exception(exctype, value, tb, length)[1:]
-        msg_lines[-1] = '  ' + msg_lines[-1]
-        msg_lines = ''.join(msg_lines)
-        return msg_lines
+        return Failure(exctype, value, tb, length)
 
     def _count_relevant_tb_levels(self, tb):
         length = 0
@@ -305,26 +1375,311 @@ class Results:
         return length
 
     def _is_relevant_tb_level(self, tb):
-        if 'TESTING_FRAME' in tb.tb_frame.f_globals:
+        return _is_testing_frame(tb.tb_frame)
+
+
+def _is_testing_frame(frame):
+    """Check if frame belongs to the test runner"""
+    if 'TESTING_FRAME' in frame.f_globals:
+        return True
+
+    if 'self' in frame.f_locals:
+        obj = frame.f_locals['self']
+        if hasattr(obj, 'TESTING_FRAME'):
             return True
 
-        if 'self' in tb.tb_frame.f_locals:
-            obj = tb.tb_frame.f_locals['self']
-            if hasattr(obj, 'TESTING_FRAME'):
-                return True
+    return False
+
+
+def _is_event_loop_frame(frame):
+    """Check if frame belongs to asyncio, which runs async tests
+    between the test runner and test code
+    """
+    return frame.f_globals.get('__name__', '').startswith('asyncio.')
+
+
+class Profiler:
+    """Sampling profiler. Stack of the main thread is sampled on SIGPROF
+    signal every interval seconds of CPU time, when profiler is enabled.
+    Frames of the test runner are filtered out as in tracebacks, samples
+    are counted by collapsed stacks ('caller;callee') used by flame
+    graph tools.
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        #: Record samples, otherwise signals are ignored
+        self.enabled = False
+        #: {collapsed stack: number of samples}
+        self.stacks = {}
+        self._labels = {}
+        self._previous_handler = None
+
+    @staticmethod
+    def is_available():
+        return hasattr(signal, 'setitimer') and hasattr(signal, 'SIGPROF')
+
+    def start(self):
+        """Start timer, has to be called in the main thread"""
+        self._previous_handler = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self._previous_handler or
+                      signal.SIG_DFL)
+
+    def _sample(self, signum, frame):
+        if not self.enabled:
+            return None
+        stack = self.get_stack(frame)
+        if stack:
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
 
-        return False
+    def get_stack(self, frame):
+        """Return collapsed stack of test code which frame belongs to,
+        empty string if it isn't called by the test runner.
+        """
+        # Runner frames called by tests, e.g. expect
+        while frame is not None and _is_testing_frame(frame):
+            frame = frame.f_back
+        frames = []
+        while frame is not None and not _is_testing_frame(frame):
+            frames.append(frame)
+            frame = frame.f_back
+        if frame is None:
+            return ''
+        # Event loop running the test
+        while frames and _is_event_loop_frame(frames[-1]):
+            frames.pop()
+        return ';'.join(self._get_label(frame.f_code)
+                        for frame in reversed(frames))
+
+    def _get_label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = '%s (%s:%s)' % (
+                getattr(code, 'co_qualname', code.co_name),
+                os.path.relpath(code.co_filename), code.co_firstlineno)
+            label = self._labels[code] = label.replace(';', ',')
+        return label
+
+    def merge(self, stacks):
+        """Add samples of other profiler"""
+        for stack, count in stacks.items():
+            self.stacks[stack] = self.stacks.get(stack, 0) + count
+
+    def pop_stacks(self):
+        stacks, self.stacks = self.stacks, {}
+        return stacks
+
+    def save(self, path):
+        """Write collapsed stacks with their samples counts"""
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write('%s %s\n' % (stack, count))
+
+
+class Reporter:
+    """Base of reporters which get results of tests as soon as they
+    complete (see Results.reporters).
+    """
+    def start(self):
+        pass
+
+    def add_result(self, behavior: Behavior, status, duration, err=None):
+        """
+        :param status: 'passed', 'failed', 'skipped' or 'skipped_slow'
+        :param duration: wall time of the test in seconds
+        :param err: Failure, its str() is formatted traceback
+        """
+        pass
+
+    def add_error(self, behavior: Behavior, err):
+        """Failure of tearing down fixtures (after_all methods or
+        session hooks) after the behavior test was already reported
+        """
+        pass
+
+    def stop(self, results: Results, time_taken):
+        pass
+
+
+class ReportsRecorder(Reporter):
+    """Keep results of tests, used to pass them from worker
+    processes to reporters of the main process.
+    """
+    def __init__(self):
+        self.reports = []
+
+    def add_result(self, behavior: Behavior, status, duration, err=None):
+        self.reports.append((behavior, status, duration, err))
+
+    def add_error(self, behavior: Behavior, err):
+        self.reports.append((behavior, 'error', 0.0, err))
+
+
+class JSONLinesReporter(Reporter):
+    """Write result of every test as JSON object in a line
+    of the file, followed by a summary line.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def start(self):
+        self._file = open(self.path, 'w')
+
+    def add_result(self, behavior: Behavior, status, duration, err=None):
+        record = {
+            'type': 'test',
+            'id': behavior._get_test_id(),
+            'description': Results.describe_test(behavior),
+            'status': status,
+            'duration': duration,
+        }
+        if err is not None:
+            record['error'] = str(err)
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+
+    def add_error(self, behavior: Behavior, err):
+        self._file.write(json.dumps({
+            'type': 'error',
+            'id': behavior._get_test_id(),
+            'description': Results.describe_test(behavior),
+            'error': str(err),
+        }) + '\n')
+        self._file.flush()
+
+    def stop(self, results: Results, time_taken):
+        self._file.write(json.dumps({
+            'type': 'summary',
+            'all': results.all,
+            'executed': results.executed,
+            'skipped': results.skipped,
+            'skipped_slow': results.skipped_slow,
+            'failures': len(results.failures),
+            'stopped': results.stopped,
+            'duration': time_taken,
+        }) + '\n')
+        self._file.close()
+
+
+class JUnitXMLReporter(Reporter):
+    """Write results in JUnit XML format. Test cases are written as
+    they complete, counters of the test suite are filled in place left
+    for them in the opening tag when the run stops.
+    """
+    suite_name = 'flowp.testing'
+    header_size = 200
+    invalid_chars_re = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._header_offset = None
+        self._counts = dict(tests=0, failures=0, skipped=0, errors=0)
+
+    def start(self):
+        self._file = open(self.path, 'w')
+        self._file.write('<?xml version="1.0" encoding="utf-8"?>\n'
+                         '<testsuites>\n')
+        self._file.flush()
+        self._header_offset = self._file.tell()
+        self._file.write(self._get_header() + '\n')
+
+    def _get_header(self, time_taken=0.0):
+        header = '<testsuite name=%s tests="%s" failures="%s" ' \
+            'skipped="%s" errors="%s" time="%.3f"' % (
+                quoteattr(self.suite_name), self._counts['tests'],
+                self._counts['failures'], self._counts['skipped'],
+                self._counts['errors'], time_taken)
+        return header + ' ' * (self.header_size - len(header) - 1) + '>'
+
+    def add_result(self, behavior: Behavior, status, duration, err=None):
+        self._file.write('  <testcase classname=%s name=%s time="%.6f"' % (
+            quoteattr(self._get_classname(behavior)),
+            quoteattr(behavior.method_name), duration))
+        self._counts['tests'] += 1
+        if status == 'failed':
+            self._counts['failures'] += 1
+            self._write_error('failure', err)
+        elif status in ('skipped', 'skipped_slow'):
+            self._counts['skipped'] += 1
+            message = 'slow' if status == 'skipped_slow' else 'skipped'
+            self._file.write('>\n    <skipped message="%s"/>\n'
+                             '  </testcase>\n' % message)
+        else:
+            self._file.write('/>\n')
+        self._file.flush()
+
+    def add_error(self, behavior: Behavior, err):
+        """Write error in a teardown test case, counted only
+        in errors of the test suite
+        """
+        self._file.write('  <testcase classname=%s name="teardown" '
+                         'time="0.000000"' % quoteattr(
+                             self._get_classname(behavior)))
+        self._counts['errors'] += 1
+        self._write_error('error', err)
+        self._file.flush()
+
+    def _get_classname(self, behavior):
+        test_id = behavior._get_test_id()
+        return test_id.rsplit('.', 1)[0].replace(':', '.')
+
+    def _write_error(self, tag, err):
+        err = self.invalid_chars_re.sub('', str(err or ''))
+        message = err.strip().splitlines()[-1].strip() if err else ''
+        self._file.write('>\n    <%s message=%s>%s</%s>\n  </testcase>\n' % (
+            tag, quoteattr(message), escape(err), tag))
+
+    def stop(self, results: Results, time_taken):
+        self._file.write('</testsuite>\n</testsuites>\n')
+        self._file.seek(self._header_offset)
+        self._file.write(self._get_header(time_taken))
+        self._file.close()
 
 
 class Runner:
     """Parse script arguments and run tests"""
     test_method_prefix = 'it_'
+    bench_method_prefix = 'bench_'
     spec_file_prefix = 'spec_'
     behavior_cls = Behavior
+    cache_cls = Cache
+    #: Directories patterns which are not searched for spec files,
+    #: virtualenvs (directories with pyvenv.cfg) are skipped as well
+    excluded_dirs = ('.*', '__pycache__', '*.egg', '*.egg-info', 'build',
+                     'dist', 'node_modules', 'site-packages', 'venv')
+    #: Runs of which retained memory of tests is kept in cache
+    memory_history = 5
 
     def __init__(self):
         self.loaded_tests = []
         self.only_mode = False
+        self.cache = self.cache_cls()
+        self.imports_recorder = ImportsRecorder()
+        #: KeywordExpression selecting tests
+        self.keyword = None
+        #: Lines selected in spec files, {spec file: set of lines}
+        self.selected_lines = {}
+        #: Ids of tests failed in the last run, if only they are selected
+        self.failed_tests = None
+        # Ids of all tests of loaded modules, also not selected ones
+        self.modules_tests = set()
+        #: Trace memory allocated by tests
+        self.memprofile = False
+        #: Load bench_ methods instead of tests
+        self.benchmark = False
+        #: Profiler sampling stacks of profiled tests
+        self.profiler = None
+        #: KeywordExpression selecting profiled tests, all if not given
+        self.profile_keyword = None
+        #: Functions of spec modules marked by before_session
+        #: and after_session
+        self.session_hooks = []
+        self.fixtures = Fixtures()
 
     def is_behavior_class(self, obj):
         return inspect.isclass(obj) and \
@@ -332,16 +1687,326 @@ class Runner:
 
     def is_test_function(self, obj):
         return inspect.isfunction(obj) and \
-            obj.__name__.startswith(self.test_method_prefix)
+            obj.__name__.startswith(self.get_method_prefix())
+
+    def get_method_prefix(self):
+        """Return prefix of methods loaded as tests"""
+        return self.bench_method_prefix if self.benchmark \
+            else self.test_method_prefix
+
+    def is_spec_file(self, path):
+        filename = os.path.basename(path)
+        return filename.startswith(self.spec_file_prefix) and \
+            filename.endswith('.py')
+
+    def is_project_file(self, path):
+        """Check if file belongs to the project in the current working
+        directory (and isn't e.g. installed in virtualenv inside it).
+        """
+        path = os.path.abspath(path)
+        if not path.startswith(os.getcwd() + os.sep):
+            return False
+        parts = path.split(os.sep)
+        return 'site-packages' not in parts and 'dist-packages' not in parts
+
+    def is_excluded_dir(self, name):
+        for pattern in self.excluded_dirs:
+            if fnmatch.fnmatch(name, pattern):
+                return True
+        return False
 
-    def get_spec_modules(self):
+    def get_spec_files(self):
+        """Find spec files in the current working directory and its
+        subdirectories. Contents of directories are cached by their
+        modification times, so only changed directories are listed.
+        """
+        cache = self.cache.get('discovery', {})
+        new_cache = {}
+        spec_files = []
+        to_visit = ['']
+        while to_visit:
+            path = to_visit.pop()
+            entry = self._scan_dir(path, cache.get(path))
+            if entry is None:
+                continue
+            new_cache[path] = entry
+            spec_files.extend(os.path.join(path, name) for name in entry[1])
+            to_visit.extend(os.path.join(path, name)
+                            for name in reversed(entry[2]))
+        if new_cache != cache:
+            self.cache.set('discovery', new_cache)
+        return spec_files
+
+    def _scan_dir(self, path, cached):
+        """Return [mtime, spec files names, subdirectories names]
+        of the directory, cached entry is used if directory wasn't
+        modified.
+        """
+        try:
+            st = os.stat(path or '.')
+        except OSError:
+            return None
+        if cached and cached[0] == st.st_mtime_ns:
+            return cached
+
+        spec_files, subdirs = [], []
+        try:
+            with os.scandir(path or '.') as entries:
+                for entry in entries:
+                    if entry.name == 'pyvenv.cfg':
+                        return [files.stable_mtime_ns(st), [], []]
+                    if entry.is_dir(follow_symlinks=False):
+                        if not self.is_excluded_dir(entry.name):
+                            subdirs.append(entry.name)
+                    elif self.is_spec_file(entry.name):
+                        spec_files.append(entry.name)
+        except OSError:
+            return None
+        return [files.stable_mtime_ns(st), sorted(spec_files),
+                sorted(subdirs)]
+
+    def collect_tests(self, spec_files=None):
+        """Collect tests from sources of spec files without importing
+        them. Return list of (spec file, tests) pairs, where tests is
+        a list of (test id, markers, lines) tuples or None if tests
+        can't be collected without import. Results are cached by files
+        modification times.
+        """
+        # Benchmarks are collected separately
+        cache_key = 'bench_collection' if self.benchmark else 'collection'
+        cache = self.cache.get(cache_key, {})
+        new_cache = dict((path, entry) for path, entry in cache.items()
+                         if os.path.exists(path))
+        collected = []
+        for path in spec_files or self.get_spec_files():
+            path = os.path.normpath(path)
+            entry = self._collect_file(path, cache.get(path))
+            new_cache[path] = entry
+            tests = entry[2]
+            if tests is not None:
+                tests = [(test_id, tuple(markers),
+                          tuple(tuple(r) for r in lines))
+                         for test_id, markers, lines in tests]
+            collected.append((path, tests))
+        if new_cache != cache:
+            self.cache.set(cache_key, new_cache)
+        return collected
+
+    def _collect_file(self, path, cached):
+        """Return [mtime, size, tests, collector version] of the spec
+        file, cached entry is used if file wasn't modified.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return [-1, -1, None, _TestsCollector.version]
+        if cached and cached[:2] == [st.st_mtime_ns, st.st_size] and \
+                cached[3:] == [_TestsCollector.version]:
+            return cached
+
+        mtime = files.stable_mtime_ns(st)
+        try:
+            with open(path, 'rb') as f:
+                tree = ast.parse(f.read(), path)
+            collector = _TestsCollector(self, self.get_module_name(path))
+            tests = collector.collect(tree)
+        except (SyntaxError, ValueError, OSError):
+            tests = None
+        return [mtime, st.st_size, tests, _TestsCollector.version]
+
+    def get_module_name(self, path):
+        fn = os.path.relpath(path).replace(os.path.sep, '.')
+        return re.sub('\.py$', '', fn)
+
+    def get_spec_modules(self, spec_files=None):
         """Get modules to tests"""
-        files = glob.glob('**/%s*.py' % self.spec_file_prefix)
-        files += glob.glob('%s*.py' % self.spec_file_prefix)
-        for fn in files:
-            fn = fn.replace(os.path.sep, '.')
-            mn = re.sub('\.py$', '', fn)
-            yield importlib.import_module(mn)
+        if spec_files is None:
+            spec_files = self.get_spec_files()
+        for fn in spec_files:
+            yield importlib.import_module(self.get_module_name(fn))
+
+    def parse_spec_files(self, spec_files):
+        """Split 'path:line' selectors into spec files paths and lines
+        selected in them. Lines of files given also without
+        line are ignored.
+        """
+        paths, lines, whole = [], {}, set()
+        for arg in spec_files:
+            path, sep, line = arg.rpartition(':')
+            if not (sep and line.isdigit()):
+                path, line = arg, None
+            path = os.path.relpath(path)
+            if path not in paths:
+                paths.append(path)
+            if line is None:
+                whole.add(path)
+            else:
+                lines.setdefault(path, set()).add(int(line))
+        return paths, dict((path, path_lines) for path, path_lines
+                           in lines.items() if path not in whole)
+
+    def select(self, spec_files=None, keyword=None, last_failed=False):
+        """Set tests selection, return spec files paths
+
+        :param spec_files:
+            list of spec files which may be given as 'path:line' to
+            select tests and behaviors defined in given lines
+        :param keyword:
+            KeywordExpression or its string
+        :param last_failed:
+            select only tests failed in the last run, all tests
+            are selected if none failed
+        """
+        if isinstance(keyword, str):
+            keyword = KeywordExpression(keyword)
+        self.keyword = keyword
+        self.selected_lines = {}
+        self.failed_tests = None
+        if last_failed:
+            self.failed_tests = self.get_failed_tests() or None
+        if spec_files:
+            spec_files, self.selected_lines = \
+                self.parse_spec_files(spec_files)
+        return spec_files or None
+
+    def is_selecting(self):
+        return bool(self.keyword or self.selected_lines or
+                    self.failed_tests is not None)
+
+    def get_failed_tests(self):
+        """Return set of ids of tests failed in the last run"""
+        return set(test_id for test_id, status
+                   in self.cache.get('statuses', {}).items()
+                   if status == 'failed')
+
+    def get_test_description(self, test_id):
+        """Return text which keyword expressions are matched against"""
+        path = test_id.split(':', 1)[-1].split('.')
+        return '%s %s %s' % (test_id, Results.describe_behaviors(path[:-1]),
+                             path[-1])
+
+    def select_tests(self, path, tests):
+        """Return ids of selected tests of the spec file
+
+        :param tests: list of (test id, markers, lines) tuples
+        """
+        selected = set(test_id for test_id, _, _ in tests
+                       if self.keyword is None or self.keyword.match(
+                           self.get_test_description(test_id)))
+        if self.failed_tests is not None:
+            selected &= self.failed_tests
+        if path in self.selected_lines:
+            in_lines = set()
+            for line in self.selected_lines[path]:
+                in_lines.update(self._select_by_line(tests, line))
+            selected &= in_lines
+        return selected
+
+    def _select_by_line(self, tests, line):
+        """Return ids of tests defined by the innermost method or
+        behavior which contains given line.
+        """
+        ranges = [r for _, _, lines in tests for r in lines
+                  if r[0] <= line <= r[1]]
+        if not ranges:
+            return set()
+        innermost = max(ranges, key=lambda r: (r[0], -r[1]))
+        return set(test_id for test_id, _, lines in tests
+                   if innermost in lines)
+
+    def select_collected(self, collected):
+        """Remove not selected tests from collected ones"""
+        if not self.is_selecting():
+            return collected
+        selected = []
+        for path, tests in collected:
+            if tests is not None:
+                ids = self.select_tests(path, tests)
+                tests = [test for test in tests if test[0] in ids]
+            selected.append((path, tests))
+        return selected
+
+    def select_loaded(self, path, behaviors, tests=None):
+        """Return selected behaviors loaded from spec file
+
+        :param tests:
+            tests collected from the spec file, if not given definition
+            lines are taken from loaded behaviors
+        """
+        lines = dict((test_id, test_lines)
+                     for test_id, _, test_lines in tests or ())
+        loaded_tests = []
+        for behavior in behaviors:
+            test_id = behavior._get_test_id()
+            if test_id not in lines:
+                lines[test_id] = self._get_lines(behavior)
+            loaded_tests.append((test_id, (), lines[test_id]))
+        ids = self.select_tests(path, loaded_tests)
+        return [behavior for behavior in behaviors
+                if behavior._get_test_id() in ids]
+
+    def _get_lines(self, behavior):
+        lines = []
+        objects = [getattr(behavior.__class__, behavior.method_name),
+                   behavior.__class__]
+        objects.extend(reversed(behavior.parent_behaviors))
+        for obj in objects:
+            try:
+                source, first = inspect.getsourcelines(obj)
+            except (OSError, TypeError):
+                continue
+            lines.append((first, first + len(source) - 1))
+        return tuple(lines)
+
+    def get_selected_spec_files(self, collected):
+        """Return spec files which have to be imported to run
+        collected tests.
+        """
+        return [path for path, tests in collected if tests is None or tests]
+
+    def save_dependencies(self, recorder: ImportsRecorder, modules):
+        """Save project files which given spec modules depend on.
+        Used to find specs affected by changed files.
+        """
+        dependencies = self.cache.get('dependencies', {})
+        dependencies = dict((spec_file, files) for spec_file, files
+                            in dependencies.items()
+                            if os.path.exists(spec_file))
+        def get_project_file(module_name):
+            path = getattr(sys.modules.get(module_name), '__file__', None)
+            if path and self.is_project_file(path):
+                return os.path.relpath(path)
+
+        for module in modules:
+            spec_file = os.path.relpath(module.__file__)
+            files = set([spec_file])
+            for name in recorder.get_dependencies(module.__name__,
+                                                  get_project_file):
+                path = get_project_file(name)
+                if path:
+                    files.add(path)
+            dependencies[spec_file] = sorted(files)
+        self.cache.set('dependencies', dependencies)
+
+    def get_affected_spec_files(self, paths):
+        """Return spec files which depend on some of given files,
+        None if dependencies are unknown.
+        """
+        dependencies = self.cache.get('dependencies')
+        if dependencies is None:
+            return None
+        paths = set(os.path.normpath(path) for path in paths)
+        affected = set(path for path in paths if self.is_spec_file(path))
+        for spec_file, files in dependencies.items():
+            if not paths.isdisjoint(files):
+                affected.add(spec_file)
+        return sorted(path for path in affected if os.path.exists(path))
+
+    def get_session_hooks(self, module):
+        for attr_name in dir(module):
+            attr = getattr(module, attr_name)
+            if inspect.isfunction(attr) and hasattr(attr, '_session_hook'):
+                yield attr
 
     def get_behavior_classes(self, module):
         for attr_name in dir(module):
@@ -367,24 +2032,700 @@ class Runner:
                     behavior_class.parent_behaviors + (behavior_class,)
                 self.load_tests(attr, results)
 
-    def run(self, fast_mode=False):
-        """Looking for behavior subclasses in modules"""
+    def load_module_tests(self, module, results: Results, tests=None):
+        """Load selected tests of the spec module
+
+        :param tests: tests collected from the module source
+        """
+        start = len(self.loaded_tests)
+        for BClass in self.get_behavior_classes(module):
+            self.load_tests(BClass, results)
+        for hook in self.get_session_hooks(module):
+            if hook not in self.session_hooks:
+                self.session_hooks.append(hook)
+        self.modules_tests.update(behavior._get_test_id()
+                                  for behavior in self.loaded_tests[start:])
+        if self.is_selecting():
+            path = os.path.relpath(module.__file__)
+            self.loaded_tests[start:] = self.select_loaded(
+                path, self.loaded_tests[start:], tests)
+
+    def run(self, fast_mode=False, jobs=1, durations=None, spec_files=None,
+            keyword=None, maxfail=None, reporters=(), last_failed=False,
+            failed_first=False, memprofile=None, benchmark=False,
+            baseline=None, save_baseline=False, profile=None,
+            profile_keyword=None):
+        """Looking for behavior subclasses in modules, return exit
+        status: 0 if all tests passed, 1 otherwise
+
+        :param jobs:
+            number of worker processes which run tests in
+            parallel, 0 means number of CPUs
+        :param durations:
+            number of slowest tests to report, 0 means all
+        :param spec_files:
+            list of spec files to run instead of all of them, 'path:line'
+            runs only tests defined in given line
+        :param keyword:
+            run only tests matching KeywordExpression
+        :param maxfail:
+            stop running tests after given number of failures
+        :param reporters:
+            list of Reporter instances
+        :param last_failed:
+            run only tests failed in the last run, or all tests
+            if none failed
+        :param failed_first:
+            run tests failed in the last run before other tests
+        :param memprofile:
+            trace memory allocated by tests and report given number
+            of the top allocating tests, 0 means all
+        :param benchmark:
+            run bench_ methods instead of tests, serially
+        :param baseline:
+            path of JSON file with benchmarks statistics which
+            results are compared with
+        :param save_baseline:
+            save results of benchmarks to the baseline file
+        :param profile:
+            path of file to which collapsed stacks of tests
+            sampled by Profiler are written
+        :param profile_keyword:
+            profile only tests matching KeywordExpression
+        """
         results = Results()
+        results.reporters = list(reporters)
         start_time = time.time()
-        # Load tests
-        for module in self.get_spec_modules():
-            for BClass in self.get_behavior_classes(module):
-                self.load_tests(BClass, results)
+        self.benchmark = benchmark
+        # Load tests, spec modules without selected tests aren't imported
+        spec_files = self.select(spec_files, keyword, last_failed)
+        collected = self.select_collected(self.collect_tests(spec_files))
+        with self.imports_recorder as recorder:
+            modules = list(self.get_spec_modules(
+                self.get_selected_spec_files(collected)))
+        self.save_dependencies(recorder, modules)
+        collected = dict(collected)
+        for module in modules:
+            self.load_module_tests(module, results, collected.get(
+                os.path.relpath(module.__file__)))
+        if self.is_selecting():
+            self.only_mode = any(
+                behavior._have_only_mode() or hasattr(
+                    getattr(behavior, behavior.method_name), '_only_mode')
+                for behavior in self.loaded_tests)
+        if benchmark:
+            baseline_stats = self.load_baseline(baseline)
+            self.set_benchmarks(baseline_stats)
+        if failed_first:
+            failed = self.get_failed_tests()
+            self.loaded_tests.sort(
+                key=lambda behavior: behavior._get_test_id() not in failed)
         results.all = len(self.loaded_tests)
 
-        # Run tests
-        for behavior in self.loaded_tests:
-            behavior.run(self.only_mode, fast_mode)
+        # Run tests, benchmarks don't compete for CPU with other workers
+        if benchmark:
+            jobs = 1
+        elif jobs <= 0:
+            jobs = os.cpu_count() or 1
+        jobs = min(jobs, len(self.loaded_tests))
+        self.fixtures = Fixtures(self.session_hooks)
+        self.memprofile = memprofile is not None
+        start_tracing = self.memprofile and not tracemalloc.is_tracing()
+        if start_tracing:
+            tracemalloc.start()
+        if profile:
+            if isinstance(profile_keyword, str):
+                profile_keyword = KeywordExpression(profile_keyword)
+            self.profile_keyword = profile_keyword
+            self.profiler = Profiler()
+            self.profiler.start()
+        for reporter in results.reporters:
+            reporter.start()
+        if jobs > 1 and 'fork' in multiprocessing.get_all_start_methods():
+            self.run_parallel(results, fast_mode, jobs, maxfail)
+        else:
+            for group in self.get_groups(self.loaded_tests):
+                if maxfail is not None and len(results.failures) >= maxfail:
+                    results.stopped = True
+                    break
+                self.run_group(group, fast_mode)
+            self.fixtures.close()
+        EventLoop.close()
+        if TemporaryDirectory.pool:
+            TemporaryDirectory.pool.close()
+        if start_tracing:
+            tracemalloc.stop()
+        if self.profiler is not None:
+            self.profiler.stop()
+            self.profiler.save(profile)
+        if benchmark:
+            # Caches of tests are neither pruned nor updated by benchmarks
+            if save_baseline and baseline:
+                self.save_baseline(baseline, results)
+        else:
+            self.save_durations(results)
+            self.save_statuses(results)
+            if self.memprofile:
+                self.save_memory(results)
 
         # Print results
         stop_time = time.time()
         time_taken = stop_time - start_time
+        for reporter in results.reporters:
+            reporter.stop(results, time_taken)
         results.print(time_taken)
+        if durations is not None:
+            results.print_durations(durations)
+        if self.memprofile:
+            results.print_memory(memprofile, self.get_growing_tests(
+                results.memory))
+        if benchmark:
+            results.print_benchmarks(baseline_stats)
+        if self.profiler is not None:
+            results.stream.writeln('\nProfile of %s samples written to %s' % (
+                sum(self.profiler.stacks.values()), profile))
+        return 1 if results.failures else 0
+
+    def print_collected(self, spec_files=None, keyword=None, stream=None,
+                        last_failed=False):
+        """Print ids of selected tests, spec modules are imported only if
+        their tests can't be collected from sources. Parameters are the
+        same as in run method.
+        """
+        stream = stream or sys.stdout
+        count = 0
+        spec_files = self.select(spec_files, keyword, last_failed)
+        for path, tests in self.select_collected(
+                self.collect_tests(spec_files)):
+            if tests is None:
+                module = importlib.import_module(self.get_module_name(path))
+                self.loaded_tests = []
+                self.load_module_tests(module, Results(NullStream()))
+                tests = [(behavior._get_test_id(), ())
+                         for behavior in self.loaded_tests]
+            for test in tests:
+                test_id, markers = test[:2]
+                if markers:
+                    stream.write('%s [%s]\n' % (test_id, ', '.join(markers)))
+                else:
+                    stream.write('%s\n' % test_id)
+                count += 1
+        stream.write('\n%s tests collected\n' % count)
+
+    def run_test(self, behavior, fast_mode):
+        """Run single test"""
+        behavior.run(self.only_mode, fast_mode, self.fixtures)
+
+    def get_groups(self, behaviors):
+        """Split tests into groups run together, async tests of
+        behavior with concurrency greater than 1 which follow each
+        other are grouped, other tests are run one by one.
+        """
+        group = []
+        for behavior in behaviors:
+            if group and self._is_concurrent(behavior) and \
+                    self._is_concurrent(group[0]) and \
+                    behavior.__class__ is group[0].__class__ and \
+                    len(group) < behavior.concurrency:
+                group.append(behavior)
+                continue
+            if group:
+                yield group
+            group = [behavior]
+        if group:
+            yield group
+
+    def _is_concurrent(self, behavior):
+        # Benchmarks are timed one by one
+        return not self.benchmark and behavior.concurrency > 1 and \
+            inspect.iscoroutinefunction(getattr(behavior,
+                                                behavior.method_name))
+
+    def run_group(self, behaviors, fast_mode):
+        """Run group of tests returned by get_groups, with memprofile
+        memory allocated by tests is recorded (tests run concurrently
+        get values of the whole group), with profiler stacks of
+        profiled tests are sampled.
+        """
+        if self.profiler is None or not self.is_profiled(behaviors[0]):
+            return self._measure_group(behaviors, fast_mode)
+        self.profiler.enabled = True
+        try:
+            self._measure_group(behaviors, fast_mode)
+        finally:
+            self.profiler.enabled = False
+
+    def is_profiled(self, behavior):
+        return self.profile_keyword is None or self.profile_keyword.match(
+            self.get_test_description(behavior._get_test_id()))
+
+    def _measure_group(self, behaviors, fast_mode):
+        if not self.memprofile:
+            return self._run_group(behaviors, fast_mode)
+        tracemalloc.reset_peak()
+        start = tracemalloc.get_traced_memory()[0]
+        self._run_group(behaviors, fast_mode)
+        current, peak = tracemalloc.get_traced_memory()
+        for behavior in behaviors:
+            test_id = behavior._get_test_id()
+            # Only executed tests
+            if test_id in behavior._results.durations:
+                behavior._results.memory[test_id] = (peak - start,
+                                                     current - start)
+
+    def _run_group(self, behaviors, fast_mode):
+        if len(behaviors) == 1:
+            return self.run_test(behaviors[0], fast_mode)
+        # Set up fixtures of the behavior out of the event loop
+        self.fixtures.enter(behaviors[0])
+
+        async def run_concurrently():
+            await asyncio.gather(*[
+                behavior.run_async(self.only_mode, fast_mode, self.fixtures)
+                for behavior in behaviors])
+        EventLoop.run(run_concurrently())
+
+    def save_durations(self, results: Results):
+        """Update tests durations cache used for scheduling
+        tests between parallel workers.
+        """
+        self._update_tests_cache('durations', results.durations)
+
+    def save_statuses(self, results: Results):
+        """Update cache of tests statuses used to select tests
+        failed in the last run.
+        """
+        self._update_tests_cache('statuses', results.statuses)
+
+    def set_benchmarks(self, baseline=None):
+        """Set Benchmark which runs bench_ method of loaded behaviors
+
+        :param baseline: {test id: statistics} to compare with
+        """
+        baseline = baseline or {}
+        for behavior in self.loaded_tests:
+            behavior._benchmark = Benchmark(
+                behavior.bench_repeat, behavior.bench_min_time,
+                behavior.bench_warmup_time,
+                baseline.get(behavior._get_test_id()),
+                behavior.bench_max_ratio)
+
+    def load_baseline(self, path):
+        """Return {test id: statistics} of benchmarks saved in JSON
+        file, empty dict if it doesn't exist.
+        """
+        if not path:
+            return {}
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def save_baseline(self, path, results: Results):
+        """Update statistics of benchmarks in the baseline file"""
+        baseline = self.load_baseline(path)
+        baseline.update(results.benchmarks)
+        tmp_path = '%s.%s.tmp' % (path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        os.replace(tmp_path, path)
+
+    def save_memory(self, results: Results):
+        """Update cache of memory retained by tests in last runs"""
+        history = self.cache.get('memory', {})
+        self._update_tests_cache('memory', dict(
+            (test_id, (history.get(test_id, []) + [retained])[
+                -self.memory_history:])
+            for test_id, (peak, retained) in results.memory.items()))
+
+    def get_growing_tests(self, memory):
+        """Return {test id: retained memory history} of tests whose
+        retained memory grew in each of the last runs (at least 3).
+        """
+        growing = {}
+        for test_id, history in self.cache.get('memory', {}).items():
+            if test_id in memory and len(history) >= 3 and all(
+                    a < b for a, b in zip(history, history[1:])):
+                growing[test_id] = history
+        return growing
+
+    def _update_tests_cache(self, key, values):
+        """Update cached {test id: value} dict by values of
+        the run, entries of removed tests are forgotten.
+        """
+        tests_ids = self.modules_tests | set(
+            b._get_test_id() for b in self.loaded_tests)
+        modules = set(test_id.split(':')[0] for test_id in tests_ids)
+        # Forget removed tests of loaded modules
+        cached = self.cache.get(key, {})
+        cached = dict((test_id, value) for test_id, value
+                      in cached.items() if test_id in tests_ids or
+                      test_id.split(':')[0] not in modules)
+        cached.update(values)
+        self.cache.set(key, cached)
+
+    def get_chunks(self, jobs):
+        """Split loaded tests indexes into chunks processed by
+        workers. If tests durations from previous runs are known,
+        there is one chunk per worker with tests assigned by the
+        longest processing time first rule. Otherwise there are few
+        chunks per worker, so workers which finish early can take
+        the rest.
+        """
+        tests_count = len(self.loaded_tests)
+        durations = self.cache.get('durations', {})
+        if not durations:
+            size = max(1, -(-tests_count // (jobs * 4)))
+            return [list(range(i, min(i + size, tests_count)))
+                    for i in range(0, tests_count, size)]
+
+        # Tests which weren't run yet get average duration
+        default = sum(durations.values()) / len(durations)
+        tests = sorted(((durations.get(b._get_test_id(), default), index)
+                        for index, b in enumerate(self.loaded_tests)),
+                       reverse=True)
+        bins = [(0, i, []) for i in range(jobs)]
+        for duration, index in tests:
+            load, i, chunk = heapq.heappop(bins)
+            chunk.append(index)
+            heapq.heappush(bins, (load + duration, i, chunk))
+        # Keep tests of the same behavior next to each other and in
+        # loaded order, also when worker takes more chunks
+        return sorted(sorted(chunk) for _, _, chunk in bins if chunk)
+
+    def run_parallel(self, results: Results, fast_mode, jobs, maxfail=None):
+        """Run loaded tests in forked worker processes and merge
+        their results. Workers inherit loaded tests from the parent,
+        so only tests indexes and results summaries are passed.
+        Workers are not daemonic, so tests can start their own
+        subprocesses. After maxfail failures, counted by all workers
+        together, workers don't start next tests. Every worker sends
+        a summary of each chunk and a last one of its fixtures tear down.
+        """
+        context = multiprocessing.get_context('fork')
+        chunks = self.get_chunks(jobs)
+        tasks = context.Queue()
+        summaries = context.Queue()
+        failures_count = context.Value('i', 0) if maxfail is not None \
+            else None
+        for chunk in chunks:
+            tasks.put(chunk)
+        workers = []
+        jobs = min(jobs, len(chunks))
+        for _ in range(jobs):
+            tasks.put(None)
+            worker = context.Process(target=_worker_loop, args=(
+                self, fast_mode, tasks, summaries, maxfail, failures_count))
+            worker.start()
+            workers.append(worker)
+
+        failures = []
+        try:
+            for _ in range(len(chunks) + jobs):
+                summary = self._get_worker_summary(summaries, workers)
+                results.merge(summary)
+                if self.profiler is not None:
+                    self.profiler.merge(summary.get('profile', {}))
+                failures.extend(summary['failures'])
+                for index, status, duration, err in summary['reports']:
+                    results.report(self.loaded_tests[index], status,
+                                   duration, err)
+                results.print_progress()
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+                worker.join()
+
+        # Keep order of failures the same as in serial run
+        failures.sort(key=lambda failure: failure[0])
+        results.failures = [(err, self.loaded_tests[index])
+                            for index, err in failures]
+
+    def _get_worker_summary(self, summaries, workers):
+        while True:
+            try:
+                summary = summaries.get(timeout=0.1)
+            except queue.Empty:
+                for worker in workers:
+                    if worker.exitcode:
+                        raise RuntimeError("worker process exited with "
+                                           "code %s" % worker.exitcode)
+                continue
+            if 'error' in summary:
+                raise RuntimeError("worker process failed:\n%s" %
+                                   summary['error'])
+            return summary
+
+
+class _TestsCollector:
+    """Find behaviors and their test methods in parsed spec module
+    the same way as Runner.load_tests does in imported one. Class
+    is recognized as a behavior if it inherits from the class named
+    like Runner.behavior_cls or from other behavior of the module.
+    Modules which could get behaviors or session hooks other way,
+    e.g. by importing names from other than standard library modules,
+    have to be imported.
+    """
+    markers = ('only', 'skip', 'slow')
+    session_hooks = ('before_session', 'after_session')
+    #: Changed when collected tests of the same source could differ
+    version = 3
+
+    class Uncertain(Exception):
+        """Tests can't be determined without importing the module"""
+
+    def __init__(self, runner: Runner, module_name):
+        self.runner = runner
+        self.module_name = module_name
+
+    def collect(self, tree):
+        """Return list of [test id, markers, lines] of the module,
+        None if module has to be imported to find them. Lines are
+        ranges of test method and its behaviors definitions, from
+        the innermost.
+        """
+        scope = self._get_classes(tree.body)
+        tests = []
+        try:
+            self._check_statements(tree.body, scope)
+            for name in sorted(scope):
+                if self._is_behavior(scope[name], scope):
+                    self._collect_behavior(scope[name], scope, [name],
+                                           set(), tests)
+        except self.Uncertain:
+            return None
+        return tests
+
+    def _check_statements(self, body, scope):
+        """Raise Uncertain if module statements could bind a behavior
+        or a session hook not defined by a class statement.
+        """
+        safe_names = set(dir(builtins))
+        safe_names.update(node.name for node in body if isinstance(
+            node, (ast.FunctionDef, ast.AsyncFunctionDef)))
+        for node in body:
+            if isinstance(node, ast.Import):
+                # Only modules are bound, but their attributes could be
+                # behaviors assigned to module names
+                safe_names.update(
+                    (alias.asname or alias.name).split('.')[0]
+                    for alias in node.names
+                    if self._is_safe_module(alias.name))
+            elif isinstance(node, ast.ImportFrom):
+                if node.level or not self._is_safe_module(node.module):
+                    raise self.Uncertain()
+                for alias in node.names:
+                    if alias.name == '*':
+                        continue
+                    name = (alias.asname or alias.name).split('.')[0]
+                    if name != self.runner.behavior_cls.__name__:
+                        safe_names.add(name)
+            elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                if set(self._get_name(decorator) for decorator
+                       in node.decorator_list) & set(self.session_hooks):
+                    raise self.Uncertain()
+            elif isinstance(node, ast.ClassDef):
+                continue
+            elif isinstance(node, ast.Expr) and \
+                    isinstance(node.value, ast.Constant):
+                # Docstring
+                continue
+            elif isinstance(node, (ast.Assign, ast.AnnAssign)) and \
+                    node.value is not None:
+                # Values made of names which can't refer to a behavior
+                names = set(n.id for n in ast.walk(node.value)
+                            if isinstance(n, ast.Name))
+                if not names <= safe_names:
+                    raise self.Uncertain()
+                targets = node.targets if isinstance(node, ast.Assign) \
+                    else [node.target]
+                for target in targets:
+                    safe_names.update(n.id for n in ast.walk(target)
+                                      if isinstance(n, ast.Name))
+            else:
+                raise self.Uncertain()
+
+    def _is_safe_module(self, name):
+        """Check if module can't define behaviors, modules of
+        standard library and package of the behavior class can't.
+        """
+        top_name = (name or '').split('.')[0]
+        if top_name == self.runner.behavior_cls.__module__.split('.')[0]:
+            return True
+        return top_name in getattr(sys, 'stdlib_module_names', ())
+
+    def _get_classes(self, body):
+        return dict((node.name, node) for node in body
+                    if isinstance(node, ast.ClassDef))
+
+    def _get_name(self, node):
+        if isinstance(node, ast.Name):
+            return node.id
+        if isinstance(node, ast.Attribute):
+            return node.attr
+        if isinstance(node, ast.Call):
+            return self._get_name(node.func)
+        return None
+
+    def _get_bases(self, node, scope):
+        """Return class nodes of local bases"""
+        bases = []
+        for base in node.bases:
+            name = self._get_name(base)
+            if isinstance(base, ast.Name) and name in scope and \
+                    scope[name] is not node:
+                bases.append(scope[name])
+            elif name not in (self.runner.behavior_cls.__name__, 'object'):
+                raise self.Uncertain()
+        return bases
+
+    def _is_behavior(self, node, scope):
+        for base in node.bases:
+            name = self._get_name(base)
+            if isinstance(base, ast.Name) and name in scope and \
+                    scope[name] is not node:
+                if self._is_behavior(scope[name], scope):
+                    return True
+            elif name == self.runner.behavior_cls.__name__:
+                return True
+            elif name != 'object':
+                # It could be a behavior defined in other module
+                raise self.Uncertain()
+        return False
+
+    def _get_markers(self, node, scope=None):
+        markers = set(self._get_name(decorator)
+                      for decorator in node.decorator_list)
+        markers.intersection_update(self.markers)
+        if scope is not None:
+            # Class attributes set by decorators are inherited
+            for base in self._get_bases(node, scope):
+                markers.update(self._get_markers(base, scope))
+        return markers
+
+    def _get_members(self, node, scope):
+        members = {}
+        for base in reversed(self._get_bases(node, scope)):
+            members.update(self._get_members(base, scope))
+        for member in node.body:
+            if isinstance(member, (ast.FunctionDef, ast.AsyncFunctionDef,
+                                   ast.ClassDef)):
+                members[member.name] = member
+            elif isinstance(member, (ast.Assign, ast.AnnAssign,
+                                     ast.AugAssign)):
+                targets = getattr(member, 'targets', None) or \
+                    [member.target]
+                for target in targets:
+                    if not isinstance(target, ast.Name):
+                        continue
+                    if target.id.startswith(
+                            self.runner.get_method_prefix()):
+                        raise self.Uncertain()
+                    members.pop(target.id, None)
+        return members
+
+    def _get_lines(self, node):
+        """Return [first, last] line of class or function definition"""
+        first = min([node.lineno] + [decorator.lineno for decorator
+                                     in node.decorator_list])
+        return [first, getattr(node, 'end_lineno', None) or node.lineno]
+
+    def _collect_behavior(self, node, scope, path, markers, tests,
+                          lines=()):
+        markers = markers | self._get_markers(node, scope)
+        lines = [self._get_lines(node)] + list(lines)
+        scope = dict(scope, **self._get_classes(node.body))
+        members = self._get_members(node, scope)
+        for name in sorted(members):
+            member = members[name]
+            if name.startswith('_'):
+                continue
+            if isinstance(member, ast.ClassDef):
+                if self._is_behavior(member, scope):
+                    self._collect_behavior(member, scope, path + [name],
+                                           markers, tests, lines)
+            elif name.startswith(self.runner.get_method_prefix()):
+                test_id = '%s:%s.%s' % (self.module_name, '.'.join(path),
+                                        name)
+                tests.append([test_id,
+                              sorted(markers | self._get_markers(member)),
+                              [self._get_lines(member)] + lines])
+
+
+def _worker_loop(runner, fast_mode, tasks, summaries, maxfail=None,
+                 failures_count=None):
+    """Take chunks of tests indexes and run them until
+    None is taken.
+    """
+    if runner.profiler is not None:
+        # Timers aren't inherited by forked process
+        runner.profiler.start()
+    for indexes in iter(tasks.get, None):
+        try:
+            summary = _run_chunk(runner, fast_mode, indexes, maxfail,
+                                 failures_count)
+        except BaseException:
+            summary = {'error': traceback.format_exc()}
+        summaries.put(summary)
+    try:
+        summary = _close_fixtures(runner)
+    except BaseException:
+        summary = {'error': traceback.format_exc()}
+    EventLoop.close()
+    if TemporaryDirectory.pool:
+        TemporaryDirectory.pool.close()
+    summaries.put(summary)
+
+
+def _close_fixtures(runner):
+    """Tear down fixtures set up in the worker process"""
+    results = Results(NullStream())
+    results.all = len(runner.loaded_tests)
+    recorder = ReportsRecorder()
+    results.reporters = [recorder]
+    tests_indexes = {}
+    behavior = runner.fixtures.last_behavior
+    if behavior is not None:
+        behavior._results = results
+        tests_indexes[id(behavior)] = runner.loaded_tests.index(behavior)
+    runner.fixtures.close()
+    return results.get_summary(tests_indexes, recorder.reports)
+
+
+def _run_chunk(runner, fast_mode, indexes, maxfail=None,
+               failures_count=None):
+    """Run tests of given indexes in the worker process
+
+    :param failures_count:
+        multiprocessing.Value with number of failures in all workers
+    """
+    results = Results(NullStream())
+    results.all = len(runner.loaded_tests)
+    recorder = ReportsRecorder()
+    results.reporters = [recorder]
+    tests_indexes = {}
+    behaviors = []
+    for index in indexes:
+        behavior = runner.loaded_tests[index]
+        behavior._results = results
+        tests_indexes[id(behavior)] = index
+        behaviors.append(behavior)
+    for group in runner.get_groups(behaviors):
+        if maxfail is not None and failures_count.value >= maxfail:
+            results.stopped = True
+            break
+        failures = len(results.failures)
+        runner.run_group(group, fast_mode)
+        if maxfail is not None and len(results.failures) > failures:
+            with failures_count.get_lock():
+                failures_count.value += len(results.failures) - failures
+    summary = results.get_summary(tests_indexes, recorder.reports)
+    if runner.profiler is not None:
+        summary['profile'] = runner.profiler.pop_stacks()
+    return summary
 
 
 class expect:
@@ -485,20 +2826,285 @@ class expect:
         self._context.assert_any_call(*args, **kwargs)
 
 
+class ForkServer:
+    """Keeps spec modules dependencies imported in a long-lived
+    process and runs tests in its forked children, so that reruns
+    don't pay for interpreter startup and imports of stable (e.g.
+    third-party) modules. Changed project modules and modules
+    importing them are dropped from sys.modules before forking,
+    children import them again.
+    """
+    def __init__(self, runner: Runner):
+        self._runner = runner
+        self.imports_recorder = runner.imports_recorder
+
+    @classmethod
+    def is_available(cls):
+        return hasattr(os, 'fork')
+
+    def preload(self, spec_files=None):
+        """Import spec modules with all their dependencies, spec
+        which can't be imported is skipped (child will report it).
+        """
+        with self.imports_recorder:
+            for fn in spec_files or self._runner.get_spec_files():
+                try:
+                    importlib.import_module(self._runner.get_module_name(fn))
+                except Exception:
+                    pass
+
+    def can_reload(self, paths):
+        """Check if changes of given files can be handled by
+        reloading modules. Runner itself can't be reloaded.
+        """
+        runner_dir = os.path.dirname(os.path.abspath(__file__)) + os.sep
+        return not any(os.path.abspath(path).startswith(runner_dir)
+                       for path in paths)
+
+    def invalidate(self, paths):
+        """Drop from sys.modules project modules of given files and
+        all modules which import them directly or indirectly.
+        """
+        paths = set(os.path.abspath(path) for path in paths)
+        modules = {}
+        for name, module in list(sys.modules.items()):
+            path = getattr(module, '__file__', None)
+            if path and self._runner.is_project_file(path) and \
+                    name != __name__ and not name.startswith(__name__ + '.'):
+                modules[name] = os.path.abspath(path)
+
+        importers = {}
+        for name in modules:
+            imports = self.imports_recorder.imports.get(name)
+            if imports is None:
+                imports = self.imports_recorder._get_references(name)
+            for imported in imports:
+                importers.setdefault(imported, set()).add(name)
+
+        to_remove = set(name for name, path in modules.items()
+                        if path in paths)
+        to_visit = list(to_remove)
+        while to_visit:
+            for importer in importers.get(to_visit.pop(), ()):
+                if importer in modules and importer not in to_remove:
+                    to_remove.add(importer)
+                    to_visit.append(importer)
+        for name in to_remove:
+            del sys.modules[name]
+            self.imports_recorder.imports.pop(name, None)
+        return to_remove
+
+    def run(self, func):
+        """Call func in forked child process, return its
+        exit status.
+        """
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                status = func() or 0
+            except SystemExit as e:
+                status = e.code if isinstance(e.code, int) else 1
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(status)
+        _, status = os.waitpid(pid, 0)
+        return os.WEXITSTATUS(status) if os.WIFEXITED(status) else 1
+
+
 class Script:
     def __init__(self):
         parser = argparse.ArgumentParser()
         parser.add_argument('--watch', action='store_true')
         parser.add_argument('--fast', action='store_true')
-        self.args = parser.parse_args()
-
-    def watch_callback(self, filename, action):
-        args = [sys.executable, '-m', 'flowp.testing']
-        if self.args.fast:
-            args.append('--fast')
-        subprocess.call(args)
+        parser.add_argument('-j', '--jobs', type=int, default=1,
+                            help='number of worker processes, '
+                                 '0 means number of CPUs')
+        parser.add_argument('--durations', type=int, metavar='N',
+                            help='show N slowest tests, 0 means all')
+        parser.add_argument('-x', '--exitfirst', action='store_const',
+                            const=1, dest='maxfail',
+                            help='stop after first failure')
+        parser.add_argument('--maxfail', type=int, metavar='N',
+                            help='stop after N failures')
+        parser.add_argument('--memprofile', type=int, metavar='N',
+                            help='trace memory allocated by tests, show N '
+                                 'top allocating tests, 0 means all')
+        parser.add_argument('--bench', action='store_true',
+                            help='run bench_ methods instead of tests')
+        parser.add_argument('--baseline', metavar='PATH',
+                            default='benchmarks.json',
+                            help='JSON file with benchmarks statistics '
+                                 'which results are compared with '
+                                 '(default: benchmarks.json)')
+        parser.add_argument('--save-baseline', action='store_true',
+                            help='save results of benchmarks as baseline')
+        parser.add_argument('--profile', metavar='PATH',
+                            help='sample stacks of tests and write them to '
+                                 'PATH as collapsed stacks for flame graphs')
+        parser.add_argument('--profile-keyword', metavar='EXPRESSION',
+                            help='profile only tests matching expression '
+                                 '(see -k)')
+        parser.add_argument('--tmpdir-pool', action='store_true',
+                            help='create tmpdir of behaviors in advance, '
+                                 'on tmpfs if available')
+        parser.add_argument('--junit-xml', metavar='PATH',
+                            help='write results in JUnit XML format')
+        parser.add_argument('--json-lines', metavar='PATH',
+                            help='write results as JSON lines')
+        parser.add_argument('--collect-only', action='store_true',
+                            help='only list tests, without importing '
+                                 'spec modules if possible')
+        parser.add_argument('--lf', '--last-failed', action='store_true',
+                            dest='last_failed',
+                            help='run only tests failed in the last run, '
+                                 'all tests if none failed')
+        parser.add_argument('--ff', '--failed-first', action='store_true',
+                            dest='failed_first',
+                            help='run tests failed in the last run first')
+        parser.add_argument('-k', metavar='EXPRESSION', dest='keyword',
+                            help='run only tests which ids or descriptions '
+                                 'match expression, e.g. '
+                                 '\'runner and not "get chunks"\'')
+        parser.add_argument('spec_files', nargs='*', metavar='SPEC_FILE',
+                            help='run only given spec files, SPEC_FILE:LINE '
+                                 'runs only tests defined in the line')
+        self.argv = sys.argv[1:]
+        self.args = parser.parse_args(self.argv)
+        # {option: whether it's followed by value, e.g. '-k EXPRESSION'}
+        self._options = dict(
+            (option, action.nargs != 0) for action in parser._actions
+            for option in action.option_strings)
+        if self.args.maxfail is not None and self.args.maxfail < 1:
+            parser.error('--maxfail must be at least 1')
+        for expression in (self.args.keyword, self.args.profile_keyword):
+            if expression is None:
+                continue
+            try:
+                KeywordExpression(expression)
+            except ValueError as e:
+                parser.error(str(e))
+        if self.args.profile and not Profiler.is_available():
+            parser.error('--profile is not supported on this platform')
+        # Spec modules are imported by paths relative to the directory
+        for path in Runner().parse_spec_files(self.args.spec_files)[0]:
+            if path == os.pardir or path.startswith(os.pardir + os.sep):
+                parser.error('spec file %s is outside of the current '
+                             'directory' % path)
+            if not os.path.isfile(path):
+                parser.error('spec file %s not found' % path)
+        self.fork_server = None
+
+    def watch_callback(self, events):
+        """Rerun specs which depend on changed files"""
+        paths = [path for path, action in events]
+        runner = Runner()
+        spec_files = runner.get_affected_spec_files(paths)
+        if spec_files is None:
+            # Dependencies unknown, rerun everything
+            spec_files = self.args.spec_files
+        else:
+            if self.args.spec_files:
+                # Keep lines selectors of given spec files
+                spec_files = [arg for arg in self.args.spec_files
+                              if runner.parse_spec_files([arg])[0][0]
+                              in spec_files]
+            if not spec_files:
+                return
+
+        if self.fork_server and self.fork_server.can_reload(paths):
+            self.fork_server.invalidate(paths)
+            self.fork_server.run(lambda: self.run_tests(spec_files))
+            return
+
+        subprocess.call(self.get_command(spec_files))
+
+    def get_command(self, spec_files):
+        """Return command running the script with the same options,
+        without watching, for given spec files
+        """
+        options = []
+        argv = iter(self.argv)
+        for arg in argv:
+            if arg == '--':
+                break
+            if arg == '--watch' or not arg.startswith('-') or arg == '-':
+                continue
+            options.append(arg)
+            if self._takes_value(arg):
+                options.append(next(argv, ''))
+        return [sys.executable, '-m', 'flowp.testing'] + options + \
+            ['--'] + list(spec_files)
+
+    def _takes_value(self, arg):
+        if arg in self._options:
+            return self._options[arg]
+        # Abbreviated long option
+        matches = [option for option in self._options
+                   if option.startswith('--') and option.startswith(arg)]
+        return len(matches) == 1 and self._options[matches[0]]
+
+    def get_reporters(self):
+        reporters = []
+        if self.args.junit_xml:
+            reporters.append(JUnitXMLReporter(self.args.junit_xml))
+        if self.args.json_lines:
+            reporters.append(JSONLinesReporter(self.args.json_lines))
+        return reporters
+
+    def run_tests(self, spec_files=None):
+        runner = Runner()
+        if self.fork_server:
+            runner.imports_recorder = self.fork_server.imports_recorder
+        return runner.run(fast_mode=self.args.fast, jobs=self.args.jobs,
+                          durations=self.args.durations,
+                          spec_files=spec_files or self.args.spec_files,
+                          keyword=self.args.keyword,
+                          maxfail=self.args.maxfail,
+                          reporters=self.get_reporters(),
+                          last_failed=self.args.last_failed,
+                          failed_first=self.args.failed_first,
+                          memprofile=self.args.memprofile,
+                          benchmark=self.args.bench,
+                          baseline=self.args.baseline,
+                          save_baseline=self.args.save_baseline,
+                          profile=self.args.profile,
+                          profile_keyword=self.args.profile_keyword)
+
+    def watch(self):
+        """Watch python files and rerun specs when they change"""
+        events_queue = queue.Queue()
+        watch = files.Watch(['*.py', '**/*.py'], debounce=0.2,
+                            batch_callback=events_queue.put)
+        try:
+            while True:
+                self.watch_callback(events_queue.get())
+        except KeyboardInterrupt:
+            watch.stop()
 
     def run(self):
-        Runner().run(fast_mode=self.args.fast)
+        """Run tests, return exit status"""
+        if self.args.collect_only:
+            runner = Runner()
+            runner.benchmark = self.args.bench
+            runner.print_collected(self.args.spec_files, self.args.keyword,
+                                   last_failed=self.args.last_failed)
+            return 0
+        if self.args.tmpdir_pool:
+            TemporaryDirectory.pool = TemporaryDirectoriesPool()
+        if self.args.watch and ForkServer.is_available():
+            runner = Runner()
+            self.fork_server = ForkServer(runner)
+            # Paths without 'path:line' selectors
+            self.fork_server.preload(
+                runner.parse_spec_files(self.args.spec_files)[0])
+            status = self.fork_server.run(self.run_tests)
+        else:
+            status = self.run_tests()
         if self.args.watch:
-            files.Watch(['*.py', '**/*.py'], self.watch_callback).wait()
+            self.watch()
+            return 0
+        return status
@@ -1,3 +1,4 @@
+import sys
 from flowp.testing import Script
 
-Script().run()
+sys.exit(Script().run())
@@ -1,9 +1,13 @@
 from flowp.testing import Behavior, skip, only, slow
 from flowp.files import cd, touch, mkdir, cp, sh, exists, \
-    isfile, isdir, pwd, Watch, rm, mv
+    isfile, isdir, pwd, Watch, rm, mv, PollingBackend, InotifyBackend, \
+    HashDetector
+from flowp import files
 from flowp import testing
 import os
 import time
+import threading
+from unittest import mock
 
 
 class expect(testing.expect):
@@ -210,6 +214,305 @@ class WatchClass(FilesBehavior):
             expect(self.filename) == 'testdir1/file2.py'
             expect(self.event) == Watch.DELETE
 
+    class WhenPollingBackendGiven(Behavior):
+        def before_each(self):
+            self.wp = Watch('testdir1/*.py', self.callback, sleep=0,
+                            backend=PollingBackend)
+            self.wp.wait_for_files_registered()
+
+        def after_each(self):
+            expect(self.wp.is_alive()).to_be(False)
+
+        def it_monitor_files_changes(self):
+            time.sleep(1)
+            with open('testdir1/file2.py', 'w') as f:
+                f.write('2')
+            self.wp.stop_when(lambda: self.event, 1)
+            expect(self.filename) == 'testdir1/file2.py'
+            expect(self.event) == Watch.CHANGE
+
+        def it_monitor_new_files(self):
+            touch('testdir1/file3.py')
+            self.wp.stop_when(lambda: self.event, 1)
+            expect(self.filename) == 'testdir1/file3.py'
+            expect(self.event) == Watch.NEW
+
+        def it_monitor_deleted_files(self):
+            rm('testdir1/file2.py')
+            self.wp.stop_when(lambda: self.event, 1)
+            expect(self.filename) == 'testdir1/file2.py'
+            expect(self.event) == Watch.DELETE
+
+    class WhenInotifyBackendGiven(Behavior):
+        def before_each(self):
+            if not InotifyBackend.is_available():
+                return
+            self.wp = Watch('**/*.py', self.callback, sleep=0,
+                            backend=InotifyBackend)
+            self.wp.wait_for_files_registered()
+
+        def it_monitor_files_in_new_directories(self):
+            if not InotifyBackend.is_available():
+                return
+            mkdir('testdir3')
+            touch('testdir3/file4.py')
+            self.wp.stop_when(lambda: self.event, 1)
+            expect(self.filename) == 'testdir3/file4.py'
+            expect(self.event) == Watch.NEW
+
+        def it_monitor_files_replaced_by_rename(self):
+            if not InotifyBackend.is_available():
+                return
+            time.sleep(1)
+            with open('testdir1/file4.tmp', 'w') as f:
+                f.write('2')
+            mv('testdir1/file4.tmp', 'testdir1/file2.py')
+            self.wp.stop_when(lambda: self.event, 1)
+            expect(self.filename) == 'testdir1/file2.py'
+            expect(self.event) == Watch.CHANGE
+
+    class WhenDebounceGiven(Behavior):
+        def before_each(self):
+            self.batches = []
+            self.wp = Watch('testdir1/*.py', sleep=0, debounce=0.3,
+                            batch_callback=self.batches.append)
+            self.wp.wait_for_files_registered()
+
+        def after_each(self):
+            expect(self.wp.is_alive()).to_be(False)
+
+        def it_pass_burst_of_actions_in_one_batch(self):
+            for i in range(10):
+                touch('testdir1/new%s.py' % i)
+            rm('testdir1/file1.py')
+            self.wp.stop_when(lambda: self.batches, 2)
+            expect(len(self.batches)) == 1
+            expect(len(self.batches[0])) == 11
+            expect(('testdir1/file1.py', Watch.DELETE))\
+                .to_be_in(self.batches[0])
+
+        def it_merge_actions_of_the_same_file(self):
+            touch('testdir1/file3.py')
+            with open('testdir1/file3.py', 'w') as f:
+                f.write('1')
+            touch('testdir1/file4.py')
+            rm('testdir1/file4.py')
+            self.wp.stop_when(lambda: self.batches, 2)
+            expect(self.batches) == [[('testdir1/file3.py', Watch.NEW)]]
+
+    class WhenStopped(Behavior):
+        def it_wakes_up_watch_loop_at_once(self):
+            for backend in (PollingBackend, InotifyBackend):
+                if not backend.is_available():
+                    continue
+                wp = Watch('testdir1/*.py', self.callback, sleep=10,
+                           backend=backend)
+                expect(wp.wait_for_files_registered(1)).to_be(True)
+                start_time = time.time()
+                wp.stop()
+                expect(time.time() - start_time) < 1
+                expect(wp.is_alive()).to_be(False)
+
+        def it_stops_waiting_for_predicate_after_timeout(self):
+            wp = Watch('testdir1/*.py', self.callback, sleep=0)
+            start_time = time.time()
+            wp.stop_when(lambda: False, 0.2)
+            expect(time.time() - start_time) < 1
+            expect(wp.is_alive()).to_be(False)
+
+        def it_loads_inotify_library_when_backend_is_created(self):
+            if not InotifyBackend.is_available():
+                return
+            self.mock(InotifyBackend, '_libc', new=None)
+            wp = Watch('testdir1/*.py', self.callback, sleep=0,
+                       backend=InotifyBackend)
+            expect(wp.wait_for_files_registered(1)).to_be(True)
+            wp.stop()
+            expect(wp._backend).to_be_instance_of(InotifyBackend)
+
+        def it_ignores_wakeup_of_closed_inotify_backend(self):
+            if not InotifyBackend.is_available():
+                return
+            backend = InotifyBackend('testdir1/*.py', 0)
+            backend.close()
+            backend.wakeup()
+            backend.close()
+
+        def it_releases_waiting_threads_when_backend_fails(self):
+            def backend(*args):
+                raise ValueError('broken backend')
+            self.mock('threading.excepthook')
+            wp = Watch('testdir1/*.py', self.callback, sleep=0,
+                       backend=backend)
+            expect(wp.wait_for_files_registered(1)).to_be(True)
+            wp.join(1)
+            expect(wp.is_alive()).to_be(False)
+
+        def it_stops_when_predicate_becomes_true_without_callbacks(self):
+            wp = Watch('testdir1/*.py', self.callback, sleep=0.05)
+            timer = threading.Timer(0.1, lambda: setattr(self, 'event', True))
+            timer.start()
+            start_time = time.time()
+            wp.stop_when(lambda: self.event, 3)
+            expect(time.time() - start_time) < 1
+            expect(wp.is_alive()).to_be(False)
+
+    class WhenHashDetectionGiven(Behavior):
+        def it_ignores_rewrites_with_the_same_content(self):
+            for backend in (PollingBackend, InotifyBackend):
+                if not backend.is_available():
+                    continue
+                self.event = False
+                wp = Watch('testdir1/*.py', self.callback, sleep=0,
+                           backend=backend, detect='hash')
+                wp.wait_for_files_registered()
+                # atomic save
+                with open('testdir1/file2.tmp', 'w') as f:
+                    f.write('1')
+                mv('testdir1/file2.tmp', 'testdir1/file2.py')
+                os.utime('testdir1/file1.py')
+                wp.stop_when(lambda: self.event, 0.5)
+                expect(self.event).to_be(False)
+
+        def it_monitor_content_changes(self):
+            for backend in (PollingBackend, InotifyBackend):
+                if not backend.is_available():
+                    continue
+                self.event = False
+                wp = Watch('testdir1/*.py', self.callback, sleep=0,
+                           backend=backend, detect='hash')
+                wp.wait_for_files_registered()
+                with open('testdir1/file2.py', 'w') as f:
+                    f.write(backend.__name__)
+                wp.stop_when(lambda: self.event, 1)
+                expect(self.filename) == 'testdir1/file2.py'
+                expect(self.event) == Watch.CHANGE
+
+        def it_raise_an_error_if_detection_mode_is_unknown(self):
+            with expect.to_raise(ValueError):
+                Watch('testdir1/*.py', self.callback, detect='size')
+
+
+class StableMtimeNs(FilesBehavior):
+    def it_returns_modification_time_of_files_modified_before(self):
+        os.utime('file0.py', (time.time() - 10, time.time() - 10))
+        st = os.stat('file0.py')
+        expect(files.stable_mtime_ns(st)) == st.st_mtime_ns
+
+    def it_returns_minus_one_for_recently_modified_files(self):
+        expect(files.stable_mtime_ns(os.stat('file0.py'))) == -1
+
+
+class MergeAction(Behavior):
+    def before_each(self):
+        self.pending = {}
+        self.merge = lambda path, action: Watch._merge_action(
+            self.pending, path, action)
+
+    def it_keeps_new_action_if_file_changed(self):
+        self.merge('a.py', Watch.NEW)
+        self.merge('a.py', Watch.CHANGE)
+        expect(self.pending) == {'a.py': Watch.NEW}
+
+    def it_drops_actions_of_created_and_deleted_file(self):
+        self.merge('a.py', Watch.NEW)
+        self.merge('a.py', Watch.DELETE)
+        expect(self.pending) == {}
+
+    def it_treats_recreated_file_as_changed(self):
+        self.merge('a.py', Watch.DELETE)
+        self.merge('a.py', Watch.NEW)
+        expect(self.pending) == {'a.py': Watch.CHANGE}
+
+    def it_keeps_delete_action_of_changed_file(self):
+        self.merge('a.py', Watch.CHANGE)
+        self.merge('a.py', Watch.DELETE)
+        expect(self.pending) == {'a.py': Watch.DELETE}
+
+
+class PollingBackendInstance(FilesBehavior):
+    def before_each(self):
+        FilesBehavior.before_each(self)
+        past = time.time() - 10
+        for path in ('.', 'testdir1', 'testdir2'):
+            os.utime(path, (past, past))
+        self.backend = PollingBackend('*/*.py', 0)
+        self.backend.register()
+
+    def it_does_not_list_unchanged_directories(self):
+        list_dir = self.mock(self.backend, '_list_dir')
+        expect(self.backend.events()) == []
+        expect(list_dir).not_to_have_been_called()
+
+    def it_lists_only_changed_directories(self):
+        touch('testdir2/file3.py')
+        list_dir = self.mock(self.backend, '_list_dir',
+                             new=mock.Mock(wraps=self.backend._list_dir))
+        expect(self.backend.events()) == [('testdir2/file3.py', Watch.NEW)]
+        expect(list_dir).to_have_been_called(1)
+        expect(list_dir).to_have_been_called_with('testdir2')
+
+    def it_finds_files_in_new_directories(self):
+        mkdir('testdir3')
+        touch('testdir3/file3.py')
+        expect(self.backend.events()) == [('testdir3/file3.py', Watch.NEW)]
+
+    def it_finds_files_of_deleted_directories(self):
+        rm('testdir1/file1.py')
+        rm('testdir1/file2.py')
+        os.rmdir('testdir1')
+        events = self.backend.events()
+        expect(len(events)) == 2
+        expect(('testdir1/file1.py', Watch.DELETE)).to_be_in(events)
+        expect(('testdir1/file2.py', Watch.DELETE)).to_be_in(events)
+
+
+class HashDetectorInstance(FilesBehavior):
+    def before_each(self):
+        FilesBehavior.before_each(self)
+        with open('file0.py', 'w') as f:
+            f.write('content')
+        past = time.time() - 10
+        os.utime('file0.py', (past, past))
+        self.subject = HashDetector()
+        self.state = self.subject.state('file0.py')
+
+    def it_does_not_hash_files_with_the_same_size_and_mtime(self):
+        hash_method = self.mock(self.subject, '_hash')
+        expect(self.subject.state('file0.py')) == self.state
+        expect(hash_method).not_to_have_been_called()
+
+    def it_hash_files_after_write(self):
+        hash_method = self.mock(self.subject, '_hash', new=mock.Mock(
+            wraps=self.subject._hash))
+        expect(self.subject.state('file0.py', modified=True)) == self.state
+        expect(hash_method).to_have_been_called(1)
+
+    def it_returns_different_state_for_different_content(self):
+        with open('file0.py', 'w') as f:
+            f.write('contenT')
+        expect(self.subject.state('file0.py')) != self.state
+
+    def it_hash_files_in_chunks(self):
+        self.subject = HashDetector()
+        self.subject._buffer = bytearray(3)
+        expect(self.subject.state('file0.py')) == self.state
+
+
+class Match(Behavior):
+    def it_matches_paths_like_glob(self):
+        expect(files._match('testdir1/file1.py', 'testdir1/*.py')).to_be(True)
+        expect(files._match('file1.py', '*.py')).to_be(True)
+        expect(files._match('a/file1.py', '**/*.py')).to_be(True)
+
+    def it_does_not_cross_directories(self):
+        expect(files._match('a/b/file1.py', '*/*.py')).to_be(False)
+        expect(files._match('a/file1.py', '*.py')).to_be(False)
+
+    def it_does_not_match_hidden_files_implicitly(self):
+        expect(files._match('.file1.py', '*.py')).to_be(False)
+        expect(files._match('.file1.py', '.*.py')).to_be(True)
+
 
 class Sh(Behavior):
     def it_executes_shell_commands(self):
@@ -4,6 +4,15 @@ from unittest import mock
 import flowp.testing.dummy
 import tempfile
 import os
+import io
+import importlib
+import sys
+import time
+import asyncio
+import json
+import pickle
+import tracemalloc
+import threading
 
 expect_alias = expect
 
@@ -206,6 +215,18 @@ class BehaviorInstance(Behavior):
                 with expect.to_raise(AttributeError):
                     flowp.testing.dummy.test_var.b
 
+            def it_stops_only_own_patchers_in_reversed_order(self):
+                other = Behavior('it_x', None)
+                other.mock(flowp.testing.dummy.test_obj, 'a', new=3)
+                behavior = Behavior('it_x', None)
+                behavior.mock('flowp.testing.dummy.test_var', new=1)
+                behavior.mock('flowp.testing.dummy.test_var', new=2)
+                behavior._stop_patchers()
+                expect(flowp.testing.dummy.test_var) == 0
+                expect(flowp.testing.dummy.test_obj.a) == 3
+                other._stop_patchers()
+                expect(flowp.testing.dummy.test_obj.a) == 0
+
             def it_raise_an_error_if_target_is_not_a_string(self):
                 o = object()
                 with expect.to_raise(TypeError):
@@ -271,6 +292,30 @@ class BehaviorInstance(Behavior):
             expect(flowp.testing.dummy.test_var) == 1
             expect(flowp.testing.dummy.test_obj.a) == 1
 
+        def it_stops_patchers_of_the_test_even_if_after_each_fails(self):
+            def patch():
+                self.behavior.mock('flowp.testing.dummy.test_var', new=1)
+            self.behavior.before_each = patch
+            self.behavior.after_each.side_effect = AssertionError()
+            self.behavior.run()
+            expect(flowp.testing.dummy.test_var) == 0
+            expect(self.results.add_failure).to_have_been_called(1)
+
+        def it_awaits_async_test_and_before_each_methods(self):
+            class AsyncBehavior(Behavior):
+                async def before_each(self):
+                    await asyncio.sleep(0)
+                    self.value = 1
+
+                async def it_is_async(self):
+                    await asyncio.sleep(0)
+                    self.executed = self.value
+
+            behavior = AsyncBehavior('it_is_async', self.results)
+            behavior.run()
+            expect(behavior.executed) == 1
+            expect(self.results.add_success).to_have_been_called()
+
         def it_should_always_call_after_each_methods(self):
             self.behavior.method_name = 'it_raise_exception'
             self.behavior.run()
@@ -278,6 +323,13 @@ class BehaviorInstance(Behavior):
             expect(self.pbehavior2.after_each).to_have_been_called()
             expect(self.behavior.after_each).to_have_been_called()
 
+        def it_should_record_test_phases_times(self):
+            self.behavior.run()
+            expect(self.results.stop_test).to_have_been_called(1)
+            behavior, timings = self.results.stop_test.call_args[0]
+            expect(behavior).to_be(self.behavior)
+            expect(sorted(timings)) == ['after_each', 'before_each', 'test']
+
         class WhenOnlyMode(Behavior):
             class AndMethodInMode(Behavior):
                 def it_should_execute_the_test(self):
@@ -345,3 +397,1059 @@ class TemporaryDirectory(Behavior):
         expect(os.path.samefile(os.getcwd(), self.subject.name)).to_be(True)
         self.subject.exit()
         expect(os.path.samefile(os.getcwd(), org_dir)).to_be(True)
+
+    class WhenPoolIsSet(Behavior):
+        def before_each(self):
+            self.root = tempfile.mkdtemp()
+            self.pool = testing.TemporaryDirectoriesPool(root=self.root)
+            self.org_pool = testing.TemporaryDirectory.pool
+            testing.TemporaryDirectory.pool = self.pool
+
+        def after_each(self):
+            testing.TemporaryDirectory.pool = self.org_pool
+            self.pool.remove()
+            os.rmdir(self.root)
+
+        def it_enters_directory_of_the_pool(self):
+            org_dir = os.getcwd()
+            self.subject.enter()
+            expect(os.getcwd().startswith(self.pool.path)).to_be(True)
+            self.subject.exit()
+            expect(os.path.samefile(os.getcwd(), org_dir)).to_be(True)
+
+        def it_reuses_empty_directories(self):
+            self.subject.enter()
+            name = self.subject.name
+            self.subject.exit()
+            self.subject.enter()
+            expect(self.subject.name) == name
+            self.subject.exit()
+
+        def it_deletes_used_directories(self):
+            self.subject.enter()
+            name = self.subject.name
+            os.makedirs('a/b')
+            self.subject.exit()
+            self.pool.close()
+            expect(os.path.exists(name)).to_be(False)
+            expect(os.listdir(self.pool.path)) == []
+
+
+class ResultsInstance(Behavior):
+    def before_each(self):
+        class TestBehavior(Behavior):
+            def it_is_test(self):
+                pass
+
+        self.stream = io.StringIO()
+        self.subject = testing.Results(self.stream)
+        self.behavior = TestBehavior('it_is_test', self.subject)
+        self.test_id = self.behavior._get_test_id()
+
+    def it_records_tests_durations(self):
+        self.subject.start_test()
+        self.subject.stop_test(self.behavior, {
+            'before_each': 0.1, 'test': 0.2, 'after_each': 0.3})
+        expect(self.subject.timings[self.test_id]) == (0.1, 0.2, 0.3)
+        expect(self.subject.durations[self.test_id]) >= 0
+
+    def it_prints_slowest_tests_and_setups(self):
+        self.subject.durations = {'a': 1.0, 'b': 3.0, 'c': 2.0}
+        self.subject.timings = {'a': (0.5, 0.4, 0.1), 'b': (0.0, 3.0, 0.0),
+                                'c': (0.1, 1.9, 0.0)}
+        self.subject.print_durations(2)
+        tests, setups = self.stream.getvalue().split('Slowest before_each')
+        expect(tests.index('  b (')) < tests.index('  c (')
+        expect('  a (').not_to_be_in(tests)
+        expect(setups.index('  a\n')) < setups.index('  c\n')
+        expect('  b\n').not_to_be_in(setups)
+
+    def it_keeps_asyncio_frames_called_by_async_tests(self):
+        async def helper():
+            raise ValueError('wrong')
+
+        class AsyncBehavior(Behavior):
+            async def it_fails(self):
+                await asyncio.wait_for(helper(), 1)
+
+        AsyncBehavior('it_fails', self.subject).run()
+        (failure, behavior), = self.subject.failures
+        expect('in it_fails').to_be_in(str(failure))
+        expect('in helper').to_be_in(str(failure))
+        expect('base_events').not_to_be_in(str(failure))
+        expect(failure.location[1]) == \
+            helper.__code__.co_firstlineno + 1
+
+    def it_passes_results_to_reporters_when_tests_complete(self):
+        recorder = testing.ReportsRecorder()
+        self.subject.reporters = [recorder]
+        self.subject.start_test(self.behavior)
+        self.subject.stop_test(self.behavior, {})
+        expect(recorder.reports[0][:2]) == (self.behavior, 'passed')
+        self.subject.start_test(self.behavior)
+        try:
+            raise AssertionError('failed')
+        except AssertionError:
+            self.subject.add_failure(sys.exc_info(), self.behavior)
+        expect(len(recorder.reports)) == 1
+        self.subject.stop_test(self.behavior, {})
+        behavior, status, duration, err = recorder.reports[1]
+        expect(status) == 'failed'
+        expect('failed').to_be_in(str(err))
+        self.subject.start_test(self.behavior)
+        self.subject.add_skipped(self.behavior)
+        expect(recorder.reports[2]) == (self.behavior, 'skipped', 0.0, None)
+
+    def it_reports_teardown_failures_of_finished_tests_as_errors(self):
+        recorder = testing.ReportsRecorder()
+        self.subject.reporters = [recorder]
+        self.subject.start_test(self.behavior)
+        self.subject.stop_test(self.behavior, {})
+        try:
+            raise AssertionError('after_all failed')
+        except AssertionError:
+            self.subject.add_failure(sys.exc_info(), self.behavior)
+        expect([report[1] for report in recorder.reports]) == [
+            'passed', 'error']
+        expect(self.subject.statuses) == {self.test_id: 'failed'}
+
+    class PrintProgressMethod(Behavior):
+        def before_each(self):
+            self.subject.all = 10
+            self.subject.executed = 1
+
+        def it_writes_summaries_in_new_lines_to_not_terminal(self):
+            self.subject.print_progress()
+            expect(self.stream.getvalue()) == ''
+            self.subject.summary_interval = 0
+            self.subject.print_progress()
+            self.subject.executed = 2
+            self.subject.print_progress()
+            lines = self.stream.getvalue().split('\n')
+            expect(lines[0].startswith('Executed 1 of 10 ')).to_be(True)
+            expect(lines[1].startswith('Executed 2 of 10 ')).to_be(True)
+            expect('\r').not_to_be_in(self.stream.getvalue())
+
+        def it_throttles_redraws_on_terminal(self):
+            class TerminalStream(io.StringIO):
+                writes = 0
+
+                def isatty(self):
+                    return True
+
+                def write(self, msg):
+                    self.writes += 1
+                    return super().write(msg)
+
+            stream = TerminalStream()
+            self.subject = testing.Results(stream)
+            self.subject.all = 10
+            self.subject.executed = 1
+            self.subject._last_progress_time -= 1
+            self.subject.print_progress()
+            self.subject.print_progress()
+            expect(stream.writes) == 1
+            expect(stream.getvalue().startswith('\rExecuted 1 of 10 ')) \
+                .to_be(True)
+
+        def it_prints_nothing_when_all_tests_are_executed(self):
+            self.subject.summary_interval = 0
+            self.subject.executed = 10
+            self.subject.print_progress()
+            expect(self.stream.getvalue()) == ''
+
+    def it_prints_top_allocating_tests(self):
+        self.subject.memory = {'a': (2048, 0), 'b': (10, 10), 'c': (5, 5)}
+        self.subject.print_memory(2, {'b': [1, 5, 10]})
+        output = self.stream.getvalue()
+        expect('   2.0 KiB peak        0 B retained  a\n').to_be_in(output)
+        expect('  c\n').not_to_be_in(output)
+        expect('  b (1 B, 5 B, 10 B)').to_be_in(output)
+
+    def it_prints_benchmarks_compared_with_baseline(self):
+        self.subject.benchmarks = {'a': {'median': 0.002, 'iqr': 0.0005,
+                                         'ops': 500.0}}
+        self.subject.print_benchmarks({'a': {'median': 0.001}})
+        expect('      2 ms \u00b1 500 us            500.0 ops/s  a '
+               '(2.00x of baseline)').to_be_in(self.stream.getvalue())
+
+    class PrintMethod(Behavior):
+        def before_each(self):
+            self.behaviors = []
+            for method_name in ('it_is_test', 'it_is_test_too'):
+                behavior = self.behavior.__class__(method_name, self.subject)
+                self.behaviors.append(behavior)
+                for i in range(2):
+                    try:
+                        if i:
+                            raise ValueError('wrong value %s' % i)
+                        raise KeyError('key')
+                    except Exception:
+                        self.subject.add_failure(sys.exc_info(), behavior)
+
+        def it_groups_failures_raised_in_the_same_place(self):
+            groups = self.subject.group_failures()
+            expect([err.exc_type for err, _ in groups]) == [
+                'KeyError', 'ValueError']
+            expect(groups[1][1]) == self.behaviors
+            self.subject.print(0.0)
+            output = self.stream.getvalue()
+            expect(output.count('Traceback')) == 0
+            expect(output.count("raise ValueError('wrong value %s' % i)")) \
+                == 1
+            expect('The same failure in 1 other tests:\n'
+                   '    Test behavior is test too\n')\
+                .to_be_in(output)
+
+        def it_sums_up_failures_over_limit_in_a_line(self):
+            self.subject.max_printed_failures = 1
+            self.subject.print(0.0)
+            output = self.stream.getvalue()
+            expect("ValueError: wrong value 1 (%s:" % __file__)\
+                .to_be_in(output)
+            expect(output.count("raise KeyError")) == 1
+            expect("raise ValueError").not_to_be_in(output)
+
+
+class Failure(Behavior):
+    def before_each(self):
+        try:
+            raise ValueError('wrong')
+        except ValueError:
+            exc_info = sys.exc_info()
+        self.line = exc_info[2].tb_lineno
+        self.subject = testing.Failure(*exc_info)
+
+    def it_keeps_exception_type_and_location(self):
+        expect(self.subject.key) == ('ValueError', (__file__, self.line))
+        expect(self.subject.message) == 'ValueError: wrong'
+
+    def it_formats_traceback_when_needed(self):
+        expect(self.subject._text).to_be(None)
+        text = str(self.subject)
+        expect("raise ValueError('wrong')").to_be_in(text)
+        expect(text.endswith('  ValueError: wrong\n')).to_be(True)
+        expect(str(self.subject)).to_be(text)
+
+    def it_formats_exception_without_traceback_levels(self):
+        failure = testing.Failure(ValueError, ValueError('wrong'), None)
+        expect(str(failure)) == '  ValueError: wrong\n'
+        expect(failure.location).to_be(None)
+
+    def it_is_pickled_without_formatting(self):
+        class LocalError(Exception):
+            pass
+
+        try:
+            raise LocalError('local')
+        except LocalError:
+            failure = testing.Failure(*sys.exc_info())
+        failure = pickle.loads(pickle.dumps(failure))
+        expect(failure._text).to_be(None)
+        expect("raise LocalError('local')").to_be_in(str(failure))
+        expect('LocalError: local').to_be_in(str(failure))
+        expect(failure.exc_type) == 'LocalError'
+
+    def it_formats_chained_exceptions(self):
+        try:
+            try:
+                raise KeyError('first')
+            except KeyError as e:
+                raise ValueError('second') from e
+        except ValueError:
+            failure = testing.Failure(*sys.exc_info())
+        text = str(failure)
+        expect(text.startswith('  File')).to_be(True)
+        expect(text.index("KeyError: 'first'")) < text.index('direct cause')
+        expect(text.index('direct cause')) < text.index('Traceback')
+        expect(text.endswith('  ValueError: second\n')).to_be(True)
+
+
+class Benchmark(Behavior):
+    def before_each(self):
+        self.subject = testing.Benchmark(repeat=5, min_time=0.01,
+                                         warmup_time=0)
+
+    def it_calibrates_number_of_calls_to_take_min_time(self):
+        self.subject._time = lambda func, calls: calls * 0.001
+        expect(self.subject.calibrate(None)) == 10
+
+    def it_measures_statistics_of_call_times(self):
+        times = iter([5.0, 1.0, 4.0, 2.0, 3.0])
+        self.subject.calibrate = lambda func: 1
+        self.subject._time = lambda func, calls: next(times)
+        stats = self.subject.measure(lambda: None)
+        expect(stats['median']) == 3.0
+        expect(stats['iqr']) == 2.0
+        expect(stats['ops']) == 1 / 3.0
+        expect((stats['calls'], stats['repeat'])) == (1, 5)
+
+    def it_calls_async_functions_in_event_loop(self):
+        calls = []
+
+        async def func():
+            calls.append(1)
+
+        self.subject.min_time = 0.001
+        try:
+            stats = self.subject.measure(func)
+        finally:
+            testing.EventLoop.close()
+        expect(len(calls)) >= stats['calls'] * stats['repeat']
+
+    def it_fails_when_median_regressed_past_max_ratio(self):
+        self.subject.check({'median': 10.0})
+        self.subject.baseline = {'median': 1.0}
+        self.subject.max_ratio = 1.5
+        self.subject.check({'median': 1.4})
+        with expect.to_raise(AssertionError):
+            self.subject.check({'median': 1.6})
+
+
+class Profiler(Behavior):
+    def before_each(self):
+        self.subject = testing.Profiler()
+
+    def it_collapses_stacks_of_test_code(self):
+        def inner():
+            return self.subject.get_stack(sys._getframe())
+
+        stack = inner().split(';')
+        expect(len(stack)) == 2
+        expect(stack[0].startswith(
+            'Profiler.it_collapses_stacks_of_test_code (spec')).to_be(True)
+        expect(stack[1].startswith(
+            'Profiler.it_collapses_stacks_of_test_code.<locals>.inner ('))\
+            .to_be(True)
+
+    def it_skips_runner_frames_called_by_tests(self):
+        class RunnerObject:
+            TESTING_FRAME = True
+
+            def get_frame(self):
+                return sys._getframe()
+
+        stack = self.subject.get_stack(RunnerObject().get_frame())
+        expect(stack.startswith('Profiler.it_skips_runner_frames')).to_be(True)
+        expect('RunnerObject').not_to_be_in(stack)
+
+    def it_ignores_code_not_called_by_runner(self):
+        stacks = []
+        thread = threading.Thread(target=lambda: stacks.append(
+            self.subject.get_stack(sys._getframe())))
+        thread.start()
+        thread.join()
+        expect(stacks) == ['']
+
+    def it_records_samples_only_when_enabled(self):
+        self.subject._sample(None, sys._getframe())
+        expect(self.subject.stacks) == {}
+        self.subject.enabled = True
+        self.subject._sample(None, sys._getframe())
+        expect(list(self.subject.stacks.values())) == [1]
+
+    def it_saves_merged_stacks(self):
+        self.tmpdir.enter()
+        try:
+            self.subject.merge({'a;b': 1, 'a': 2})
+            self.subject.merge({'a;b': 2})
+            self.subject.save('profile.txt')
+            with open('profile.txt') as f:
+                expect(f.read()) == 'a 2\na;b 3\n'
+        finally:
+            self.tmpdir.exit()
+
+
+class Reporters(Behavior):
+    def before_each(self):
+        class TestBehavior(Behavior):
+            def it_is_test(self):
+                pass
+
+        self.tmpdir.enter()
+        self.results = testing.Results(testing.NullStream())
+        self.results.all = 2
+        self.results.executed = 2
+        self.results.failures = [('err', None)]
+        self.passed = TestBehavior('it_is_test', self.results)
+        self.failed = TestBehavior('it_is_test', self.results)
+
+    def after_each(self):
+        self.tmpdir.exit()
+
+    def report(self, reporter):
+        reporter.start()
+        reporter.add_result(self.passed, 'passed', 0.5)
+        reporter.add_result(self.failed, 'failed', 0.25,
+                            '  File "x.py"\n  AssertionError: <1 & 2>\x1b\n')
+        reporter.add_error(self.passed, '  File "y.py"\n  ValueError\n')
+        reporter.stop(self.results, 1.0)
+
+    def it_writes_junit_xml(self):
+        from xml.dom import minidom
+        self.report(testing.JUnitXMLReporter('results.xml'))
+        document = minidom.parse('results.xml')
+        suite = document.getElementsByTagName('testsuite')[0]
+        expect(suite.getAttribute('tests')) == '2'
+        expect(suite.getAttribute('failures')) == '1'
+        expect(suite.getAttribute('errors')) == '1'
+        cases = document.getElementsByTagName('testcase')
+        expect(cases[0].getAttribute('classname')) == \
+            'spec.spec_testing.TestBehavior'
+        failure = cases[1].getElementsByTagName('failure')[0]
+        expect(failure.getAttribute('message')) == 'AssertionError: <1 & 2>'
+        expect(cases[2].getAttribute('name')) == 'teardown'
+        error = cases[2].getElementsByTagName('error')[0]
+        expect(error.getAttribute('message')) == 'ValueError'
+
+    def it_writes_json_lines(self):
+        self.report(testing.JSONLinesReporter('results.jsonl'))
+        with open('results.jsonl') as f:
+            records = [json.loads(line) for line in f]
+        expect([r['type'] for r in records]) == [
+            'test', 'test', 'error', 'summary']
+        expect(records[0]['id']) == 'spec.spec_testing:TestBehavior.it_is_test'
+        expect(records[1]['status']) == 'failed'
+        expect(records[2]['id']) == records[0]['id']
+        expect(records[3]['failures']) == 1
+
+
+class Cache(Behavior):
+    def before_each(self):
+        self.tmpdir.enter()
+        self.subject = testing.Cache()
+
+    def after_each(self):
+        self.tmpdir.exit()
+
+    def it_persists_values(self):
+        self.subject.set('key', {'a': [1]})
+        expect(testing.Cache().get('key')) == {'a': [1]}
+
+    def it_ignores_errors_of_writing(self):
+        open('.flowp_cache', 'w').close()
+        self.subject.set('key', 1)
+        expect(self.subject.get('key', 0)) == 0
+
+    def it_removes_temporary_file_when_writing_fails(self):
+        os.makedirs(os.path.join('.flowp_cache', 'key.json'))
+        self.subject.set('key', 1)
+        expect(os.listdir('.flowp_cache')) == ['key.json']
+
+
+class KeywordExpression(Behavior):
+    def it_matches_words_case_insensitively(self):
+        keyword = testing.KeywordExpression('Chunks')
+        expect(keyword.match('Get chunks method')).to_be(True)
+        expect(keyword.match('Run method')).to_be(False)
+
+    def it_supports_operators_and_parentheses(self):
+        keyword = testing.KeywordExpression(
+            'runner and not (slow or "get chunks")')
+        expect(keyword.match('Runner run method')).to_be(True)
+        expect(keyword.match('Runner get chunks method')).to_be(False)
+        expect(keyword.match('Runner slow test')).to_be(False)
+        expect(keyword.match('Results')).to_be(False)
+
+    def it_raises_value_error_for_invalid_expression(self):
+        for expression in ('runner and', '(runner', 'runner)', 'not'):
+            with expect.to_raise(ValueError):
+                testing.KeywordExpression(expression)
+
+
+class Fixtures(Behavior):
+    def before_each(self):
+        calls = self.calls = []
+
+        class Subject(Behavior):
+            def before_all(self):
+                calls.append('subject before_all')
+                self.db = ['db']
+
+            def after_all(self):
+                calls.append('subject after_all')
+
+            def it_uses_db(self):
+                calls.append(self.db)
+
+            class Nested(Behavior):
+                def before_all(self):
+                    calls.append('nested before_all')
+                    self.db = self.db + ['nested']
+
+                def it_uses_nested_db(self):
+                    calls.append(self.db)
+
+            @skip
+            def it_is_skipped(self):
+                pass
+
+        class Failing(Behavior):
+            def before_all(self):
+                raise RuntimeError('failed setup')
+
+            def it_fails(self):
+                calls.append('failing test')
+
+        def start():
+            calls.append('session start')
+
+        def stop():
+            calls.append('session stop')
+
+        self.runner = testing.Runner()
+        self.results = testing.Results(testing.NullStream())
+        self.runner.load_tests(Subject, self.results)
+        self.runner.load_tests(Failing, self.results)
+        self.runner.fixtures = testing.Fixtures([
+            testing.before_session(start), testing.after_session(stop)])
+
+    def run_tests(self):
+        for behavior in self.runner.loaded_tests:
+            self.runner.run_test(behavior, False)
+        self.runner.fixtures.close()
+
+    def it_sets_up_behaviors_once_and_shares_their_attributes(self):
+        self.run_tests()
+        expect(self.calls[:7]) == [
+            'session start', 'subject before_all', 'nested before_all',
+            ['db', 'nested'], ['db'], 'subject after_all', 'session stop']
+
+    def it_fails_tests_of_behavior_which_set_up_failed(self):
+        self.run_tests()
+        expect('failing test').not_to_be_in(self.calls)
+        expect(len(self.results.failures)) == 1
+        err, behavior = self.results.failures[0]
+        expect(behavior.method_name) == 'it_fails'
+        expect('failed setup').to_be_in(str(err))
+
+    def it_doesnt_set_up_behaviors_without_executed_tests(self):
+        behavior = [b for b in self.runner.loaded_tests
+                    if b.method_name == 'it_is_skipped'][0]
+        self.runner.run_test(behavior, False)
+        self.runner.fixtures.close()
+        expect(self.calls) == []
+
+
+class ImportsRecorder(Behavior):
+    def it_records_modules_imports(self):
+        with testing.ImportsRecorder() as recorder:
+            exec('import flowp.testing.dummy\n'
+                 'from flowp import files', {'__name__': 'spec_x'})
+        expect(recorder.imports['spec_x']) == set([
+            'flowp', 'flowp.testing', 'flowp.testing.dummy', 'flowp.files'])
+
+    def it_returns_indirect_dependencies(self):
+        recorder = testing.ImportsRecorder()
+        recorder.imports = {'a': set(['b']), 'b': set(['c']),
+                            'c': set(['d']), 'd': set()}
+        expect(recorder.get_dependencies('a')) == set(['a', 'b', 'c', 'd'])
+        expect(recorder.get_dependencies(
+            'a', lambda name: name != 'c')) == set(['a', 'b', 'c'])
+
+    def it_guess_imports_of_modules_imported_before_recording(self):
+        recorder = testing.ImportsRecorder()
+        expect('flowp.files').to_be_in(
+            recorder.get_dependencies('flowp.testing', lambda name:
+                                      name.startswith('flowp')))
+
+
+class ForkServer(Behavior):
+    def before_each(self):
+        self.tmpdir.enter()
+        with open('fs_a.py', 'w') as f:
+            f.write('X = 1\n')
+        with open('fs_b.py', 'w') as f:
+            f.write('import fs_a\n')
+        with open('fs_c.py', 'w') as f:
+            f.write('X = 1\n')
+        with open('spec_fs.py', 'w') as f:
+            f.write('import fs_b\nimport fs_c\n')
+        self.path = os.getcwd()
+        sys.path.insert(0, self.path)
+        self.subject = testing.ForkServer(testing.Runner())
+        self.subject.preload(['spec_fs.py'])
+
+    def after_each(self):
+        sys.path.remove(self.path)
+        for name in ('fs_a', 'fs_b', 'fs_c', 'spec_fs'):
+            sys.modules.pop(name, None)
+        self.tmpdir.exit()
+
+    def it_preloads_spec_modules(self):
+        expect('spec_fs').to_be_in(sys.modules)
+        expect('fs_a').to_be_in(sys.modules)
+
+    def it_drops_changed_modules_and_their_importers(self):
+        removed = self.subject.invalidate(['fs_a.py'])
+        expect(removed) == set(['fs_a', 'fs_b', 'spec_fs'])
+        expect('fs_c').to_be_in(sys.modules)
+
+    def it_runs_function_in_child_process(self):
+        if not testing.ForkServer.is_available():
+            return
+        pid = os.getpid()
+        expect(self.subject.run(lambda: os.getpid() != pid and 3)) == 3
+
+
+class Script(Behavior):
+    def before_each(self):
+        self.tmpdir.enter()
+        open('spec_a.py', 'w').close()
+
+    def after_each(self):
+        self.tmpdir.exit()
+
+    def it_reruns_spec_files_with_the_same_options(self):
+        self.mock('sys.argv', new=[
+            'flowp.testing', '--watch', '-j', '2', '-k', 'runner',
+            '--dur', '3', '--junit-xml=results.xml', '-x', 'spec_a.py:1'])
+        command = testing.Script().get_command(['spec_b.py'])
+        expect(command[1:3]) == ['-m', 'flowp.testing']
+        expect(command[3:]) == [
+            '-j', '2', '-k', 'runner', '--dur', '3',
+            '--junit-xml=results.xml', '-x', '--', 'spec_b.py']
+
+
+class RunnerInstance(Behavior):
+    def before_each(self):
+        class TestBehavior(Behavior):
+            def it_passes(self):
+                pass
+
+            def it_fails(self):
+                raise AssertionError()
+
+            @skip
+            def it_is_skipped(self):
+                pass
+
+        self.tmpdir.enter()
+        self.subject = testing.Runner()
+        self.results = testing.Results(testing.NullStream())
+        self.subject.load_tests(TestBehavior, self.results)
+        self.results.all = len(self.subject.loaded_tests)
+
+    def after_each(self):
+        self.tmpdir.exit()
+
+    class GetChunksMethod(Behavior):
+        def it_splits_tests_into_chunks(self):
+            chunks = self.subject.get_chunks(2)
+            expect(sum(chunks, [])) == [0, 1, 2]
+
+        def it_balance_chunks_by_tests_durations(self):
+            tests_ids = [b._get_test_id() for b in self.subject.loaded_tests]
+            self.subject.cache.set('durations', {
+                tests_ids[0]: 1.0, tests_ids[1]: 3.0, tests_ids[2]: 2.0})
+            chunks = sorted(self.subject.get_chunks(2))
+            expect(chunks) == [[0, 2], [1]]
+
+        def it_gives_average_duration_to_new_tests(self):
+            tests_ids = [b._get_test_id() for b in self.subject.loaded_tests]
+            self.subject.cache.set('durations', {
+                tests_ids[0]: 1.0, tests_ids[1]: 3.0})
+            chunks = sorted(self.subject.get_chunks(2))
+            expect(chunks) == [[0, 2], [1]]
+
+    class GetSpecFilesMethod(Behavior):
+        def before_each(self):
+            for path in ('spec/unit', '.git', 'node_modules/pkg', 'venv2'):
+                os.makedirs(path)
+            for path in ('spec_a.py', 'spec/spec_b.py', 'spec/unit/spec_c.py',
+                         'spec/helper.py', '.git/spec_d.py',
+                         'node_modules/pkg/spec_e.py', 'venv2/pyvenv.cfg',
+                         'venv2/spec_f.py'):
+                open(path, 'w').close()
+            past = time.time() - 10
+            for path in ('.', 'spec', 'spec/unit', '.git', 'node_modules',
+                         'node_modules/pkg', 'venv2'):
+                os.utime(path, (past, past))
+
+        def it_finds_spec_files_in_subdirectories(self):
+            expect(self.subject.get_spec_files()) == [
+                'spec_a.py', 'spec/spec_b.py', 'spec/unit/spec_c.py']
+
+        def it_lists_only_changed_directories(self):
+            self.subject.get_spec_files()
+            cache = self.subject.cache.get('discovery')
+            cache['spec'][1] = ['spec_cached.py']
+            cache['spec/unit'][1] = ['spec_cached.py']
+            self.subject.cache.set('discovery', cache)
+            open('spec/unit/spec_g.py', 'w').close()
+            expect(self.subject.get_spec_files()) == [
+                'spec_a.py', 'spec/spec_cached.py', 'spec/unit/spec_c.py',
+                'spec/unit/spec_g.py']
+
+    class CollectTestsMethod(Behavior):
+        def write(self, path, source):
+            with open(path, 'w') as f:
+                f.write(source)
+
+        def it_collects_tests_without_importing_spec_modules(self):
+            self.write('spec_collected.py', (
+                "from flowp.testing import Behavior, skip, slow\n"
+                "import flowp.testing\n"
+                "class Base(Behavior):\n"
+                "    def it_is_inherited(self): pass\n"
+                "@slow\n"
+                "class Subject(Base):\n"
+                "    def it_works(self): pass\n"
+                "    def helper(self): pass\n"
+                "    @skip\n"
+                "    def it_is_skipped(self): pass\n"
+                "    class WhenNested(flowp.testing.Behavior):\n"
+                "        def it_works_too(self): pass\n"
+                "class Helper:\n"
+                "    def it_is_not_test(self): pass\n"))
+            (path, tests), = self.subject.collect_tests(['spec_collected.py'])
+            expect(path) == 'spec_collected.py'
+            expect([test[:2] for test in tests]) == [
+                ('spec_collected:Base.it_is_inherited', ()),
+                ('spec_collected:Subject.WhenNested.it_works_too',
+                 ('slow',)),
+                ('spec_collected:Subject.it_is_inherited', ('slow',)),
+                ('spec_collected:Subject.it_is_skipped',
+                 ('skip', 'slow')),
+                ('spec_collected:Subject.it_works', ('slow',))]
+            expect(tests[1][2]) == ((12, 12), (11, 12), (5, 12))
+            expect('spec_collected').not_to_be_in(sys.modules)
+
+        def it_returns_none_if_module_has_to_be_imported(self):
+            self.write('spec_other.py', (
+                "import helpers\n"
+                "class Subject(helpers.SharedBehavior):\n"
+                "    pass\n"))
+            self.write('spec_invalid.py', "class Subject(\n")
+            expect(self.subject.collect_tests(
+                ['spec_other.py', 'spec_invalid.py'])) == [
+                    ('spec_other.py', None), ('spec_invalid.py', None)]
+
+        def it_returns_none_if_module_could_bind_behaviors_otherwise(self):
+            self.write('spec_reexport.py', "from helpers import Shared\n")
+            self.write('spec_conditional.py', (
+                "import sys\n"
+                "from flowp.testing import Behavior\n"
+                "if sys.platform:\n"
+                "    class Subject(Behavior):\n"
+                "        def it_works(self): pass\n"))
+            self.write('spec_hooks.py', (
+                "from flowp.testing import before_session\n"
+                "@before_session\n"
+                "def setup(): pass\n"))
+            self.write('spec_alias.py', (
+                "import helpers\n"
+                "Shared = helpers.Shared\n"))
+            self.write('spec_empty.py', (
+                '"""Docstring."""\n'
+                "import os\n"
+                "PATH = os.path.join('a', 'b')\n"
+                "def helper(): pass\n"))
+            expect(self.subject.collect_tests(
+                ['spec_reexport.py', 'spec_conditional.py', 'spec_hooks.py',
+                 'spec_alias.py', 'spec_empty.py'])) == [
+                    ('spec_reexport.py', None), ('spec_conditional.py', None),
+                    ('spec_hooks.py', None), ('spec_alias.py', None),
+                    ('spec_empty.py', [])]
+
+        def it_collects_tests_of_modules_importing_project_modules(self):
+            self.write('spec_project.py', (
+                "import project_module\n"
+                "import project.submodule as submodule\n"
+                "from flowp.testing import Behavior\n"
+                "class Subject(Behavior):\n"
+                "    def it_works(self):\n"
+                "        project_module.run(submodule)\n"))
+            (path, tests), = self.subject.collect_tests(['spec_project.py'])
+            expect([test[0] for test in tests]) == [
+                'spec_project:Subject.it_works']
+
+    class SelectCollectedMethod(Behavior):
+        def before_each(self):
+            with open('spec_selected.py', 'w') as f:
+                f.write(
+                    "from flowp.testing import Behavior\n"   # 1
+                    "class Subject(Behavior):\n"             # 2
+                    "    def it_works(self):\n"              # 3
+                    "        pass\n"                         # 4
+                    "    class WhenNested(Behavior):\n"      # 5
+                    "        def it_works_too(self):\n"      # 6
+                    "            pass\n"                     # 7
+                    "        def it_fails(self):\n"          # 8
+                    "            pass\n")                    # 9
+
+        def selected(self, spec_files, keyword=None):
+            spec_files = self.subject.select(spec_files, keyword)
+            collected = self.subject.select_collected(
+                self.subject.collect_tests(spec_files))
+            return [test[0].split(':')[1] for test in collected[0][1]]
+
+        def it_selects_tests_by_keyword_expression(self):
+            expect(self.selected(['spec_selected.py'],
+                                 'nested and not fails')) == [
+                'Subject.WhenNested.it_works_too']
+
+        def it_selects_test_method_by_line(self):
+            expect(self.selected(['spec_selected.py:7'])) == [
+                'Subject.WhenNested.it_works_too']
+
+        def it_selects_behavior_tests_by_line(self):
+            expect(self.selected(['spec_selected.py:5',
+                                  'spec_selected.py:3'])) == [
+                'Subject.WhenNested.it_fails',
+                'Subject.WhenNested.it_works_too', 'Subject.it_works']
+
+        def it_selects_spec_files_given_by_absolute_paths(self):
+            path = os.path.abspath('spec_selected.py')
+            expect(self.selected([path + ':3'])) == ['Subject.it_works']
+            expect(self.subject.get_module_name(path)) == 'spec_selected'
+
+        def it_selects_all_tests_of_file_given_without_line(self):
+            expect(len(self.selected(['spec_selected.py:5',
+                                      'spec_selected.py']))) == 3
+
+        def it_selects_loaded_tests_of_not_collected_files(self):
+            self.subject.select(['spec_selected.py:8'], 'fails')
+            sys.path.insert(0, os.getcwd())
+            try:
+                module = importlib.import_module('spec_selected')
+                self.subject.loaded_tests = []
+                self.subject.load_module_tests(module, self.results)
+            finally:
+                sys.path.remove(os.getcwd())
+                sys.modules.pop('spec_selected', None)
+            expect([b.method_name for b in self.subject.loaded_tests]) == [
+                'it_fails']
+
+    class GetAffectedSpecFilesMethod(Behavior):
+        def before_each(self):
+            os.mkdir('spec')
+            for path in ('spec/spec_a.py', 'spec/spec_b.py', 'a.py', 'b.py'):
+                open(path, 'w').close()
+            self.subject.cache.set('dependencies', {
+                'spec/spec_a.py': ['a.py', 'spec/spec_a.py'],
+                'spec/spec_b.py': ['a.py', 'b.py', 'spec/spec_b.py'],
+            })
+
+        def it_returns_specs_depending_on_changed_files(self):
+            expect(self.subject.get_affected_spec_files(['b.py'])) == \
+                ['spec/spec_b.py']
+            expect(self.subject.get_affected_spec_files(['./a.py'])) == \
+                ['spec/spec_a.py', 'spec/spec_b.py']
+            expect(self.subject.get_affected_spec_files(['c.py'])) == []
+
+        def it_returns_changed_spec_files(self):
+            open('spec/spec_c.py', 'w').close()
+            expect(self.subject.get_affected_spec_files(
+                ['spec/spec_c.py'])) == ['spec/spec_c.py']
+
+        def it_returns_none_if_dependencies_are_unknown(self):
+            self.subject.cache.set('dependencies', None)
+            expect(self.subject.get_affected_spec_files(['a.py'])).to_be(None)
+
+    class RunMethod(Behavior):
+        def it_saves_durations_of_executed_tests(self):
+            self.subject.only_mode = False
+            for behavior in self.subject.loaded_tests:
+                self.subject.run_test(behavior, False)
+            self.subject.save_durations(self.results)
+            durations = self.subject.cache.get('durations')
+            expect(len(durations)) == 2
+            expect('spec.spec_testing:TestBehavior.it_is_skipped')\
+                .not_to_be_in(durations)
+
+        def it_records_memory_allocated_by_tests_with_memprofile(self):
+            self.subject.only_mode = False
+            self.subject.memprofile = True
+            tracemalloc.start()
+            try:
+                for behavior in self.subject.loaded_tests:
+                    self.subject.run_group([behavior], False)
+            finally:
+                tracemalloc.stop()
+            expect(len(self.results.memory)) == 2
+            for peak, retained in self.results.memory.values():
+                expect(peak) >= retained
+
+        def it_finds_tests_whose_retained_memory_grows(self):
+            self.subject.memory_history = 3
+            self.subject.cache.set('memory', {'a:A.it_a': [1, 2, 3],
+                                              'b:B.it_b': [3, 2]})
+            self.results.memory = {'a:A.it_a': (10, 4), 'b:B.it_b': (10, 4)}
+            self.subject.save_memory(self.results)
+            expect(self.subject.get_growing_tests(self.results.memory)) == {
+                'a:A.it_a': [2, 3, 4]}
+
+        def it_doesnt_import_spec_modules_without_tests(self):
+            with open('spec_empty.py', 'w') as f:
+                f.write("import os\n"
+                        "IMPORTED = os.environ['FLOWP_NOT_IMPORTED']\n")
+            expect(self.subject.get_selected_spec_files(
+                self.subject.collect_tests(['spec_empty.py']))) == []
+
+        def it_stops_after_max_failures(self):
+            with open('spec_failing.py', 'w') as f:
+                f.write("from flowp.testing import Behavior\n"
+                        "class Subject(Behavior):\n"
+                        "    def it_fails(self): raise AssertionError()\n"
+                        "    def it_fails_too(self): raise AssertionError()\n"
+                        "    def it_passes(self): pass\n")
+            stdout = self.mock('sys.stdout', new=io.StringIO())
+            self.subject.loaded_tests = []
+            sys.path.insert(0, os.getcwd())
+            try:
+                status = self.subject.run(spec_files=['spec_failing.py'],
+                                          maxfail=1)
+            finally:
+                sys.path.remove(os.getcwd())
+                sys.modules.pop('spec_failing', None)
+            expect(status) == 1
+            expect('Executed 1 of 3').to_be_in(stdout.getvalue())
+            expect('STOPPED').to_be_in(stdout.getvalue())
+
+        def run_failing_spec(self, runner, **kwargs):
+            with open('spec_failing.py', 'w') as f:
+                f.write("from flowp.testing import Behavior\n"
+                        "class Subject(Behavior):\n"
+                        "    def it_fails(self): raise AssertionError()\n"
+                        "    def it_passes(self): pass\n")
+            stdout = self.mock('sys.stdout', new=io.StringIO())
+            sys.path.insert(0, os.getcwd())
+            try:
+                runner.run(spec_files=['spec_failing.py'], **kwargs)
+            finally:
+                sys.path.remove(os.getcwd())
+                sys.modules.pop('spec_failing', None)
+            return stdout.getvalue()
+
+        def it_prints_top_allocating_tests_with_memprofile(self):
+            output = self.run_failing_spec(testing.Runner(), memprofile=1)
+            expect('Top allocating tests:').to_be_in(output)
+            expect(output.count(' retained  spec_failing:Subject.')) == 1
+
+        def it_runs_benchmarks_and_compares_them_with_baseline(self):
+            with open('spec_bench.py', 'w') as f:
+                f.write("from flowp.testing import Behavior\n"
+                        "class Subject(Behavior):\n"
+                        "    bench_repeat = 3\n"
+                        "    bench_min_time = 0.001\n"
+                        "    bench_warmup_time = 0\n"
+                        "    def bench_sum(self): sum(range(10))\n"
+                        "    def bench_max(self): max(range(10))\n"
+                        "    def it_passes(self): pass\n")
+            stdout = self.mock('sys.stdout', new=io.StringIO())
+            statuses = {'spec_bench:Subject.it_passes': 'passed'}
+            self.subject.cache.set('statuses', statuses)
+            sys.path.insert(0, os.getcwd())
+            try:
+                run_parallel = self.mock('flowp.testing.Runner.run_parallel')
+                status = testing.Runner().run(
+                    spec_files=['spec_bench.py'], benchmark=True, jobs=2,
+                    baseline='baseline.json', save_baseline=True)
+                expect(status) == 0
+                expect(run_parallel.called).to_be(False)
+                expect(self.subject.cache.get('statuses')) == statuses
+                expect(self.subject.cache.get('durations', {})) == {}
+                expect('Executed 2 of 2').to_be_in(stdout.getvalue())
+                with open('baseline.json') as f:
+                    baseline = json.load(f)
+                stats = baseline['spec_bench:Subject.bench_sum']
+                expect(stats['repeat']) == 3
+                stats['median'] /= 100
+                with open('baseline.json', 'w') as f:
+                    json.dump(baseline, f)
+                status = testing.Runner().run(
+                    spec_files=['spec_bench.py'], benchmark=True,
+                    baseline='baseline.json')
+            finally:
+                sys.path.remove(os.getcwd())
+                sys.modules.pop('spec_bench', None)
+            expect(status) == 1
+            expect('expected at most 1.50x')\
+                .to_be_in(stdout.getvalue())
+
+        def it_writes_profile_of_tests(self):
+            if not testing.Profiler.is_available():
+                return None
+            output = self.run_failing_spec(testing.Runner(),
+                                           profile='profile.txt',
+                                           profile_keyword='passes')
+            expect(os.path.exists('profile.txt')).to_be(True)
+            expect('samples written to profile.txt').to_be_in(output)
+
+        def it_saves_statuses_of_tests(self):
+            self.run_failing_spec(testing.Runner())
+            expect(self.subject.cache.get('statuses')) == {
+                'spec_failing:Subject.it_fails': 'failed',
+                'spec_failing:Subject.it_passes': 'passed'}
+            expect(self.subject.get_failed_tests()) == {
+                'spec_failing:Subject.it_fails'}
+
+        def it_runs_only_tests_failed_in_the_last_run(self):
+            output = self.run_failing_spec(testing.Runner(), last_failed=True)
+            expect('Executed 2 of 2').to_be_in(output)
+            runner = testing.Runner()
+            output = self.run_failing_spec(runner, last_failed=True)
+            expect('Executed 1 of 1').to_be_in(output)
+            expect(runner.loaded_tests[0].method_name) == 'it_fails'
+            # Not selected tests aren't forgotten
+            expect(len(self.subject.cache.get('statuses'))) == 2
+
+        def it_runs_tests_failed_in_the_last_run_first(self):
+            self.subject.cache.set('statuses', {
+                'spec_failing:Subject.it_passes': 'failed'})
+            runner = testing.Runner()
+            self.run_failing_spec(runner, failed_first=True)
+            expect([b.method_name for b in runner.loaded_tests]) == [
+                'it_passes', 'it_fails']
+            expect(self.subject.get_failed_tests()) == {
+                'spec_failing:Subject.it_fails'}
+
+    class RunGroupMethod(Behavior):
+        def before_each(self):
+            class AsyncBehavior(Behavior):
+                concurrency = 2
+
+                async def it_sets_event(self):
+                    self.event.set()
+
+                async def it_waits_for_event(self):
+                    await asyncio.wait_for(self.event.wait(), 1)
+
+                def it_is_sync(self):
+                    pass
+
+            self.subject.loaded_tests = []
+            self.subject.load_tests(AsyncBehavior, self.results)
+            self.behaviors = self.subject.loaded_tests
+            AsyncBehavior.event = asyncio.Event()
+
+        def after_each(self):
+            testing.EventLoop.close()
+
+        def it_groups_async_tests_of_concurrent_behaviors(self):
+            groups = list(self.subject.get_groups(self.behaviors))
+            expect([[b.method_name for b in group] for group in groups]) == [
+                ['it_is_sync'], ['it_sets_event', 'it_waits_for_event']]
+
+        def it_runs_async_tests_concurrently(self):
+            self.subject.run_group(self.behaviors[1:], False)
+            expect(self.results.failures) == []
+            expect(self.results.executed) == 2
+
+    class RunParallelMethod(Behavior):
+        def it_stops_workers_after_max_failures(self):
+            self.subject.loaded_tests.sort(key=lambda b: b.method_name)
+            self.subject.run_parallel(self.results, False, 1, maxfail=1)
+            expect(len(self.results.failures)) == 1
+            expect(self.results.executed) == 1
+            expect(self.results.stopped).to_be(True)
+
+        def it_merges_workers_results(self):
+            self.subject.run_parallel(self.results, False, 2)
+            expect(self.results.executed) == 2
+            expect(self.results.skipped) == 1
+            expect(len(self.results.failures)) == 1
+            err, behavior = self.results.failures[0]
+            expect(behavior.method_name) == 'it_fails'
+            expect('AssertionError').to_be_in(str(err))